@@ -1,23 +1,29 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 from uuid import uuid4
 
-# Try to import LLM service, but don't fail if it's not available
-try:
-    from llm_service import generate_personalized_first_aid, explain_recommendations
-    LLM_AVAILABLE = True
-except Exception as e:
-    print(f"Warning: LLM service not available: {e}")
-    LLM_AVAILABLE = False
-    # Define fallback functions
-    def generate_personalized_first_aid(symptoms, severity, vitals):
-        return []
-    def explain_recommendations(specialties, severity, drivers):
-        return ""
+import startup
+import triage_rules
+from deadline import Deadline
+from symptom_matcher import match_codes
+
+# The LLM and retrieval services (and the openai/chromadb clients behind them)
+# are imported on first use or by the start-up warm-up, not with this module.
+# Every caller falls back to the rule-based path if the import fails.
+_llm_service = startup.lazy("llm_service")
+_embeddings_service = startup.lazy("embeddings_service")
 
 def now() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
+def _stamp(ts: datetime) -> str:
+    return ts.isoformat() + "Z"
+
 def safe_number(x, fallback=None):
     try:
         if x is None:
@@ -32,152 +38,158 @@ def normalize_symptoms(text: str) -> List[str]:
     tokens = [t.strip() for t in text.replace("\n", ",").split(",")]
     return [t for t in tokens if t]
 
+# Typed outputs of the rule agents. Agents pass these to each other as-is;
+# the display strings of the ledger are only rendered by `ledger()`.
+@dataclass
+class Intake:
+    __slots__ = ("timestamp", "age", "sex", "symptoms", "symptom_codes", "duration_hours", "vitals", "rules", "patient_name")
+    timestamp: datetime
+    age: Optional[float]
+    sex: str
+    symptoms: List[str]
+    symptom_codes: List[str]
+    duration_hours: Optional[float]
+    vitals: Dict[str, Optional[float]]
+    rules: triage_rules.RuleResult
+    patient_name: Optional[str]
+
+    @property
+    def flags(self) -> List[str]:
+        return self.rules.flags
+
+    def ledger(self) -> Dict:
+        vitals = self.vitals
+        out = {
+            "agent": "symptom_intake",
+            "timestamp": _stamp(self.timestamp),
+            "patient_age": self.age,
+            "patient_sex": self.sex,
+            "reported_symptoms": ", ".join(self.symptoms) or "None",
+            "recognized_symptoms": ", ".join(self.symptom_codes) or "None",
+            "symptom_duration_hours": self.duration_hours,
+            "heart_rate_bpm": vitals["heartRate"],
+            "systolic_bp_mmhg": vitals["systolicBP"],
+            "diastolic_bp_mmhg": vitals["diastolicBP"],
+            "oxygen_saturation_percent": vitals["spo2"],
+            "temperature_celsius": vitals["temperatureC"],
+            "detected_flags": ", ".join(self.flags) if self.flags else "None",
+            "assessment": "Structured intake for triage; flags are non-diagnostic safety signals.",
+        }
+        if self.patient_name is not None:
+            out["patientName"] = self.patient_name
+        return out
+
+@dataclass
+class Risk:
+    __slots__ = ("timestamp", "score", "tier", "factors")
+    timestamp: datetime
+    score: int
+    tier: str
+    factors: List[str]
+
+    scoring_model = "Composite rule-based from age, vitals, duration, and flags"
+
+    def ledger(self) -> Dict:
+        return {
+            "agent": "risk_scoring",
+            "timestamp": _stamp(self.timestamp),
+            "risk_score": self.score,
+            "risk_tier": self.tier,
+            "risk_factors": ", ".join(self.factors) if self.factors else "No significant risk factors",
+            "scoring_model": self.scoring_model,
+        }
+
+@dataclass
+class Severity:
+    __slots__ = ("timestamp", "band", "drivers", "risk_score")
+    timestamp: datetime
+    band: str  # lower case, e.g. "critical"
+    drivers: List[str]
+    risk_score: int
+
+    def ledger(self) -> Dict:
+        return {
+            "agent": "severity_prediction",
+            "timestamp": _stamp(self.timestamp),
+            "severity_band": self.band.upper(),
+            "severity_drivers": ", ".join(self.drivers) if self.drivers else "No critical severity drivers",
+            "risk_score_basis": f"Based on composite risk score of {self.risk_score}",
+            "classification_note": "Non-diagnostic severity band for triage demo only",
+        }
+
+@dataclass
+class Priority:
+    __slots__ = ("timestamp", "level", "name", "severity", "flags", "guidance")
+    timestamp: datetime
+    level: str
+    name: str
+    severity: str
+    flags: List[str]
+    guidance: str
+
+    def ledger(self) -> Dict:
+        return {
+            "agent": "emergency_priority",
+            "timestamp": _stamp(self.timestamp),
+            "priority_level": self.level,
+            "priority_name": self.name,
+            "classification_basis": f"Severity: {self.severity.upper()}, Critical Flags: {', '.join(self.flags) if self.flags else 'None'}",
+            "action_guidance": self.guidance,
+        }
+
 # 1) Symptom Intake Agent
-def symptom_intake_agent(payload: Dict):
+def symptom_intake_agent(payload: Dict) -> Intake:
     vit = payload.get("vitals", {}) or {}
-    intake = {
-        "age": safe_number(payload.get("age"), None),
-        "sex": payload.get("sex") or "unspecified",
-        "symptoms": normalize_symptoms(payload.get("symptomsText", "")),
-        "durationHours": safe_number(payload.get("durationHours"), None),
-        "vitals": {
-            "heartRate": safe_number(vit.get("heartRate"), None),
-            "systolicBP": safe_number(vit.get("systolicBP"), None),
-            "diastolicBP": safe_number(vit.get("diastolicBP"), None),
-            "spo2": safe_number(vit.get("spo2"), None),
-            "temperatureC": safe_number(vit.get("temperatureC"), None),
-        },
+    symptoms_text = payload.get("symptomsText", "")
+    age = safe_number(payload.get("age"), None)
+    duration = safe_number(payload.get("durationHours"), None)
+    # Canonical symptom codes, matched once; every later agent reads these
+    codes = match_codes(symptoms_text)
+    vitals = {
+        "heartRate": safe_number(vit.get("heartRate"), None),
+        "systolicBP": safe_number(vit.get("systolicBP"), None),
+        "diastolicBP": safe_number(vit.get("diastolicBP"), None),
+        "spo2": safe_number(vit.get("spo2"), None),
+        "temperatureC": safe_number(vit.get("temperatureC"), None),
     }
 
-    flags = []
-    if intake["vitals"]["spo2"] is not None and intake["vitals"]["spo2"] < 92: flags.append("low_spo2")
-    if intake["vitals"]["systolicBP"] is not None and intake["vitals"]["systolicBP"] < 90: flags.append("low_bp")
-    if intake["vitals"]["heartRate"] is not None and intake["vitals"]["heartRate"] > 120: flags.append("tachycardia")
-    if intake["vitals"]["temperatureC"] is not None and intake["vitals"]["temperatureC"] >= 39.0: flags.append("high_fever")
-    s = set(intake["symptoms"])
-    if "chest pain" in s: flags.append("chest_pain")
-    if "shortness of breath" in s: flags.append("dyspnea")
-    if "severe headache" in s: flags.append("severe_headache")
+    # All rules (flags, risk, severity, priority) are evaluated once here;
+    # the downstream agents read the result from `rules`
+    rules = triage_rules.active().evaluate({"age": age, "durationHours": duration, "symptomCodes": codes, "vitals": vitals})
 
-    return {
-        "agent": "symptom_intake",
-        "timestamp": now(),
-        "patient_age": intake["age"],
-        "patient_sex": intake["sex"],
-        "reported_symptoms": ", ".join(intake["symptoms"]) or "None",
-        "symptom_duration_hours": intake["durationHours"],
-        "heart_rate_bpm": intake["vitals"]["heartRate"],
-        "systolic_bp_mmhg": intake["vitals"]["systolicBP"],
-        "diastolic_bp_mmhg": intake["vitals"]["diastolicBP"],
-        "oxygen_saturation_percent": intake["vitals"]["spo2"],
-        "temperature_celsius": intake["vitals"]["temperatureC"],
-        "detected_flags": ", ".join(flags) if flags else "None",
-        "assessment": "Structured intake for triage; flags are non-diagnostic safety signals.",
-        "_intake_obj": intake,
-        "_flags": flags
-    }
+    return Intake(datetime.utcnow(), age, payload.get("sex") or "unspecified", normalize_symptoms(symptoms_text),
+                  codes, duration, vitals, rules, payload.get("patientName"))
 
 # 2) Risk Scoring Agent
-def risk_scoring_agent(intake_output: Dict):
-    age = intake_output.get("patient_age")
-    dur = intake_output.get("symptom_duration_hours")
-    hr = intake_output.get("heart_rate_bpm")
-    sbp = intake_output.get("systolic_bp_mmhg")
-    spo2 = intake_output.get("oxygen_saturation_percent")
-    temp = intake_output.get("temperature_celsius")
-    flags = intake_output.get("_flags", [])
-    
-    risk = 0
-    risk_factors = []
-
-    if age is not None:
-        if age >= 75: risk += 3; risk_factors.append(f"Age >= 75 (+3)")
-        elif age >= 60: risk += 2; risk_factors.append(f"Age 60-74 (+2)")
-        elif age >= 40: risk += 1; risk_factors.append(f"Age 40-59 (+1)")
-
-    if dur is not None:
-        if dur >= 72: risk += 2; risk_factors.append(f"Duration >= 72h (+2)")
-        elif dur >= 24: risk += 1; risk_factors.append(f"Duration 24-72h (+1)")
-
-    if spo2 is not None and spo2 < 92: risk += 4; risk_factors.append(f"Low SpO2 {spo2}% (+4)")
-    if sbp is not None and sbp < 90: risk += 3; risk_factors.append(f"Low SBP {sbp} mmHg (+3)")
-    if hr is not None and hr > 120: risk += 2; risk_factors.append(f"Tachycardia {hr} bpm (+2)")
-    if temp is not None and temp >= 39: risk += 1; risk_factors.append(f"High fever {temp}°C (+1)")
-
-    flag_weights = {
-        "chest_pain": 4, "dyspnea": 3, "severe_headache": 2,
-        "low_spo2": 4, "low_bp": 3, "tachycardia": 2, "high_fever": 1
-    }
-    for f in flags:
-        w = flag_weights.get(f, 0)
-        if w > 0:
-            risk += w
-            risk_factors.append(f"Flag '{f}' (+{w})")
-
-    tier = "low"
-    if risk >= 9: tier = "high"
-    elif risk >= 5: tier = "moderate"
-
-    return {
-        "agent": "risk_scoring",
-        "timestamp": now(),
-        "risk_score": risk,
-        "risk_tier": tier,
-        "risk_factors": ", ".join(risk_factors) if risk_factors else "No significant risk factors",
-        "scoring_model": "Composite rule-based from age, vitals, duration, and flags",
-        "_risk": risk,
-        "_tier": tier
-    }
+def risk_scoring_agent(intake: Intake) -> Risk:
+    rules = intake.rules
+    return Risk(datetime.utcnow(), rules.risk, rules.tier, rules.risk_factors)
 
 # 3) Severity Prediction Agent
-def severity_prediction_agent(intake_output: Dict, risk_output: Dict):
-    spo2 = intake_output.get("oxygen_saturation_percent")
-    sbp = intake_output.get("systolic_bp_mmhg")
-    hr = intake_output.get("heart_rate_bpm")
-    symptoms_str = intake_output.get("reported_symptoms", "")
-    r = risk_output.get("_risk", 0)
-    
-    severity = "mild"
-    if r >= 9: severity = "critical"
-    elif r >= 6: severity = "severe"
-    elif r >= 3: severity = "moderate"
-
-    drivers = []
-    if spo2 is not None and spo2 < 92: drivers.append(f"Low oxygen saturation ({spo2}%)")
-    if "chest pain" in symptoms_str.lower(): drivers.append("Reported chest pain")
-    if "shortness of breath" in symptoms_str.lower() or "dyspnea" in symptoms_str.lower(): drivers.append("Breathing difficulty")
-    if sbp is not None and sbp < 90: drivers.append(f"Low blood pressure ({sbp} mmHg)")
-    if hr is not None and hr > 120: drivers.append(f"Rapid heart rate ({hr} bpm)")
-
-    return {
-        "agent": "severity_prediction",
-        "timestamp": now(),
-        "severity_band": severity.upper(),
-        "severity_drivers": ", ".join(drivers) if drivers else "No critical severity drivers",
-        "risk_score_basis": f"Based on composite risk score of {r}",
-        "classification_note": "Non-diagnostic severity band for triage demo only",
-        "_severity": severity
-    }
+def severity_prediction_agent(intake: Intake, risk: Risk) -> Severity:
+    # Computed by the same rule evaluation as the risk score
+    rules = intake.rules
+    return Severity(datetime.utcnow(), rules.severity, rules.drivers, risk.score)
 
 # 4) Doctor Recommendation Agent
-def doctor_recommendation_agent(intake_output: Dict):
-    symptoms_str = intake_output.get("reported_symptoms", "").lower()
-    spo2 = intake_output.get("oxygen_saturation_percent")
+# (symptom codes, specialty, recommendation), in report order
+SPECIALTY_RULES = [
+    (frozenset({"chest_pain", "dyspnea"}), "Cardiology", "Cardiac assessment needed"),
+    (frozenset({"fever", "cough"}), "General Medicine", "Infectious disease screening"),
+    (frozenset({"severe_headache", "dizziness"}), "Neurology", "Neurological evaluation"),
+    (frozenset({"abdominal_pain", "vomiting"}), "Gastroenterology", "GI assessment needed"),
+]
+
+def doctor_recommendation_agent(intake: Intake):
+    codes = intake.symptom_codes
+    spo2 = intake.vitals["spo2"]
     specialties = []
     recommendations = []
 
-    if "chest pain" in symptoms_str or "shortness of breath" in symptoms_str: 
-        specialties.append("Cardiology")
-        recommendations.append("Cardiac assessment needed")
-    if "fever" in symptoms_str or "cough" in symptoms_str: 
-        specialties.append("General Medicine")
-        recommendations.append("Infectious disease screening")
-    if "severe headache" in symptoms_str or "dizziness" in symptoms_str: 
-        specialties.append("Neurology")
-        recommendations.append("Neurological evaluation")
-    if "abdominal pain" in symptoms_str or "vomiting" in symptoms_str: 
-        specialties.append("Gastroenterology")
-        recommendations.append("GI assessment needed")
+    for rule_codes, specialty, recommendation in SPECIALTY_RULES:
+        if not rule_codes.isdisjoint(codes):
+            specialties.append(specialty)
+            recommendations.append(recommendation)
     if spo2 is not None and spo2 < 92: 
         specialties.append("Pulmonology")
         recommendations.append("Respiratory support may be needed")
@@ -196,138 +208,124 @@ def doctor_recommendation_agent(intake_output: Dict):
     }
 
 # 5) Emergency Priority Classifier
-def emergency_priority_classifier(severity_output: Dict, intake_output: Dict):
-    severity = severity_output.get("_severity", "mild").upper()
-    flags_str = intake_output.get("detected_flags", "")
-    flags = set([f.strip() for f in flags_str.split(",") if f.strip() and f.strip() != "None"])
-    
-    priority = "P3"
-    priority_name = "Non-Urgent"
-    
-    if "CRITICAL" in severity: 
-        priority = "P1"
-        priority_name = "EMERGENCY"
-    elif "SEVERE" in severity: 
-        priority = "P2"
-        priority_name = "URGENT"
-
-    if any(f in flags for f in ["chest_pain", "low_spo2", "low_bp"]):
-        if priority == "P3":
-            priority = "P2"
-            priority_name = "URGENT"
-
-    guidance_map = {
-        "P1": "Immediate emergency response advised. Call emergency services now.",
-        "P2": "Prompt clinical evaluation recommended. Seek medical care urgently.",
-        "P3": "Non-urgent; monitor symptoms and seek routine care if symptoms persist or worsen."
-    }
-    guidance = guidance_map.get(priority, "Unknown priority")
-
-    return {
-        "agent": "emergency_priority",
-        "timestamp": now(),
-        "priority_level": priority,
-        "priority_name": priority_name,
-        "classification_basis": f"Severity: {severity}, Critical Flags: {', '.join(flags) if flags else 'None'}",
-        "action_guidance": guidance,
-        "_priority": priority
-    }
+def emergency_priority_classifier(severity: Severity, intake: Intake) -> Priority:
+    # Level, name and guidance all come from the rule version that scored the intake
+    rules = intake.rules.compiled
+    flags = intake.flags
+    level = intake.rules.priority
+    return Priority(datetime.utcnow(), level, rules.priority_names[level], severity.band, flags,
+                    rules.guidance.get(level, "Unknown priority"))
 
 # 6) Medical Report Agent
-def medical_report_agent(case_id: str, intake_output: Dict, risk_output: Dict, severity_output: Dict, doctor_output: Dict, priority_output: Dict):
-    # Add first aid recommendations - enhanced with LLM and retrieval if available
-    intake_obj = intake_output.get("_intake_obj", {})
-    symptoms_list = intake_obj.get("symptoms", [])
-    severity = severity_output.get("_severity", "mild")
-    vitals = intake_obj.get("vitals", {})
+_SKIPPED = object()  # enrichment abandoned because the latency budget ran out
+_PENDING = object()  # enrichment deferred to a background worker
+
+# The report is built in stages (retrieve -> generate -> assemble -> index) so
+# the sync and async orchestrators can share them and schedule I/O differently.
+def _vitals_text(vitals: Dict) -> str:
+    return ",".join(f"{name}={value}" for name, value in (vitals or {}).items() if value is not None)
 
-    # Attempt retrieval of similar cases to provide context
-    similar_cases = []
+def _report_context_text(intake: Intake) -> str:
+    return f"patient:{intake.patient_name or ''}; age:{intake.age}; symptoms:{','.join(intake.symptoms)}; vitals:{_vitals_text(intake.vitals)}"
+
+def _retrieve_context(context_text: str, timeout: Optional[float] = None) -> List:
+    """Attempt retrieval of similar cases to provide context (best-effort)."""
     try:
-        from embeddings_service import retrieve_similar_cases, upsert_case
-        # build a short context string
-        context_text = f"patient:{intake_output.get('patientName','')}; age:{intake_output.get('patient_age')}; symptoms:{','.join(symptoms_list)}"
-        similar_cases = retrieve_similar_cases(context_text, k=3) or []
+        return _embeddings_service().retrieve_similar_cases(context_text, k=3, timeout=timeout) or []
     except Exception:
-        similar_cases = []
+        return []
 
-    # Try to generate enhanced report via LLM (RAG)
-    enhanced = None
+def _generate_enhanced_report(intake: Intake, severity: Severity, similar_cases: List, timeout: Optional[float] = None):
+    """Try to generate enhanced report via LLM (RAG); None on failure."""
     try:
-        from llm_service import generate_case_report
+        generate_case_report = _llm_service().generate_case_report
         case_summary = {
-            "patientName": intake_output.get("patientName") or "",
-            "age": intake_output.get("patient_age"),
-            "sex": intake_output.get("patient_sex"),
-            "symptoms": symptoms_list,
-            "durationHours": intake_output.get("symptom_duration_hours"),
-            "vitals": vitals,
-            "severity": severity,
+            "patientName": intake.patient_name or "",
+            "age": intake.age,
+            "sex": intake.sex,
+            "symptoms": intake.symptoms,
+            "symptomCodes": intake.symptom_codes,
+            "durationHours": intake.duration_hours,
+            "vitals": intake.vitals,
+            "severity": severity.band,
         }
-        enhanced = generate_case_report(case_summary, similar_cases)
+        return generate_case_report(case_summary, similar_cases, timeout=timeout)
     except Exception:
-        enhanced = None
+        return None
 
-    # first_aid default
+def _rule_based_first_aid(symptom_codes: List[str], severity: str) -> List[str]:
+    # fallback rules if LLM not available or returned nothing
     first_aid = []
-    if enhanced and enhanced.get("first_aid"):
+    codes = set(symptom_codes)
+    if "chest_pain" in codes:
+        first_aid.append("Keep the person calm and seated. Call emergency services immediately.")
+    if "dyspnea" in codes:
+        first_aid.append("Help the person sit upright. Loosen tight clothing. Seek medical help if severe.")
+    if "fever" in codes:
+        first_aid.append("Keep hydrated. Use a cool compress. Monitor temperature.")
+    if severity == "critical":
+        first_aid.append("Do not give anything by mouth. Monitor breathing and pulse. Be ready to perform CPR if needed.")
+    if not first_aid:
+        first_aid.append("Monitor symptoms and seek medical attention if they worsen.")
+    return first_aid
+
+def _assemble_report(case_id: str, intake: Intake, risk: Risk, severity_output: Severity, doctor_output: Dict, priority: Priority, enhanced):
+    # `enhanced` is the LLM report, None when it failed, _SKIPPED when the
+    # latency budget ran out before enrichment finished, or _PENDING when it
+    # will be merged in later by a background worker
+    symptom_codes = intake.symptom_codes
+    severity = severity_output.band
+
+    # first_aid default
+    if enhanced is _SKIPPED:
+        first_aid = _rule_based_first_aid(symptom_codes, severity)
+        enrichment = "Skipped (latency budget exhausted)"
+    elif enhanced is _PENDING:
+        first_aid = _rule_based_first_aid(symptom_codes, severity)
+        enrichment = "Pending (background enrichment)"
+    elif enhanced and enhanced.get("first_aid"):
         first_aid = enhanced.get("first_aid")
+        enrichment = "LLM-enhanced"
     else:
-        # fallback rules if LLM not available or returned nothing
-        symptoms = set(symptoms_list)
-        if "chest pain" in symptoms:
-            first_aid.append("Keep the person calm and seated. Call emergency services immediately.")
-        if "shortness of breath" in symptoms:
-            first_aid.append("Help the person sit upright. Loosen tight clothing. Seek medical help if severe.")
-        if "fever" in symptoms:
-            first_aid.append("Keep hydrated. Use a cool compress. Monitor temperature.")
-        if severity == "critical":
-            first_aid.append("Do not give anything by mouth. Monitor breathing and pulse. Be ready to perform CPR if needed.")
-        if not first_aid:
-            first_aid.append("Monitor symptoms and seek medical attention if they worsen.")
+        first_aid = _rule_based_first_aid(symptom_codes, severity)
+        enrichment = "Rule-based"
 
     report = {
         "caseId": case_id,
         "generatedAt": now(),
         "disclaimer": "Informational triage demo; not medical diagnosis or treatment.",
         "summary": {
-            "patientName": intake_output.get("patientName") or "",
-            "age": intake_output.get("patient_age"),
-            "sex": intake_output.get("patient_sex"),
-            "symptoms": intake_obj.get("symptoms", []),
-            "durationHours": intake_output.get("symptom_duration_hours"),
-            "vitals": vitals,
+            "patientName": intake.patient_name or "",
+            "age": intake.age,
+            "sex": intake.sex,
+            "symptoms": intake.symptoms,
+            "durationHours": intake.duration_hours,
+            "vitals": intake.vitals,
         },
         "triage": {
-            "riskScore": risk_output.get("_risk"),
-            "riskTier": risk_output.get("_tier"),
-            "severityBand": severity_output.get("_severity", "unknown"),
-            "emergencyPriority": priority_output.get("_priority"),
+            "riskScore": risk.score,
+            "riskTier": risk.tier,
+            "severityBand": severity,
+            "emergencyPriority": priority.level,
         },
         "recommendations": {
             "suggestedSpecialties": doctor_output.get("_specialties", []),
-            "generalGuidance": priority_output.get("action_guidance"),
+            "generalGuidance": priority.guidance,
             "firstAid": first_aid,
         },
         "rationale": {
-            "riskModel": risk_output.get("scoring_model"),
-            "severityDrivers": [d.strip() for d in severity_output.get("severity_drivers", "").split(",")] if severity_output.get("severity_drivers") else [],
-            "notes": intake_output.get("_flags", []),
+            "riskModel": risk.scoring_model,
+            "severityDrivers": severity_output.drivers,
+            "notes": intake.flags,
         },
     }
 
-    # Upsert the case text into embedding DB for future retrieval (best-effort)
-    try:
-        from embeddings_service import upsert_case
-        text_for_index = f"case:{case_id}; patient:{intake_output.get('patientName','')}; symptoms:{','.join(symptoms_list)}; severity:{severity}; summary:{';'.join(first_aid[:3])}"
-        upsert_case(case_id, text_for_index)
-    except Exception:
-        pass
     return {
         "agent": "medical_report",
         "timestamp": now(),
         "case_id": report["caseId"],
         "report_status": "Generated",
+        "enrichment": enrichment,
         "patient_name": report["summary"].get("patientName", "N/A"),
         "triage_severity": report["triage"].get("severityBand", "Unknown").upper(),
         "emergency_priority": report["triage"].get("emergencyPriority", "Unknown"),
@@ -337,8 +335,42 @@ def medical_report_agent(case_id: str, intake_output: Dict, risk_output: Dict, s
         "_report": report
     }
 
+def _index_case(case_id: str, intake: Intake, report_output: Dict):
+    """Upsert the case text into embedding DB for future retrieval (best-effort)."""
+    report = report_output.get("_report", {})
+    symptoms_list = report.get("summary", {}).get("symptoms", [])
+    severity = report.get("triage", {}).get("severityBand", "mild")
+    first_aid = report.get("recommendations", {}).get("firstAid", [])
+    try:
+        upsert_case = _embeddings_service().upsert_case
+        text_for_index = f"case:{case_id}; patient:{intake.patient_name or ''}; age:{intake.age}; symptoms:{','.join(symptoms_list)}; vitals:{_vitals_text(report.get('summary', {}).get('vitals'))}; severity:{severity}; summary:{';'.join(first_aid[:3])}"
+        # embed from the retrieval query so its memoized vector is reused
+        upsert_case(case_id, text_for_index, embed_from=_report_context_text(intake))
+    except Exception:
+        pass
+
+def _call_within(deadline: Optional[Deadline], fallback, fn, *args):
+    """Run fn(*args, timeout=...) but return `fallback` once the deadline passes."""
+    if deadline is None or deadline.remaining() is None:
+        return fn(*args)
+    if deadline.expired():
+        return fallback
+    future = _IO_EXECUTOR.submit(fn, *args, timeout=deadline.remaining())
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeout:
+        return fallback
+
+def medical_report_agent(case_id: str, intake: Intake, risk: Risk, severity: Severity, doctor_output: Dict, priority: Priority, deadline: Optional[Deadline] = None):
+    # Add first aid recommendations - enhanced with LLM and retrieval if available
+    similar_cases = _call_within(deadline, [], _retrieve_context, _report_context_text(intake))
+    enhanced = _call_within(deadline, _SKIPPED, _generate_enhanced_report, intake, severity, similar_cases)
+    output = _assemble_report(case_id, intake, risk, severity, doctor_output, priority, enhanced)
+    _index_case(case_id, intake, output)
+    return output
+
 # 7) Resource-aware Community Coordinator
-def community_response_coordinator(priority_output: Dict, location_hint: str = "Community Zone A"):
+def community_response_coordinator(priority: Priority, location_hint: str = "Community Zone A"):
     resources = [
         {"name": "Ambulance A1", "type": "ambulance", "etaMinutes": 8, "available": True},
         {"name": "Ambulance A2", "type": "ambulance", "etaMinutes": 20, "available": True},
@@ -346,7 +378,7 @@ def community_response_coordinator(priority_output: Dict, location_hint: str = "
         {"name": "Hospital H1", "type": "hospital", "icuBeds": 1, "available": True},
     ]
     plan = []
-    pr = priority_output.get("_priority", "P3")
+    pr = priority.level
     if pr == "P1":
         amb = next((r for r in resources if r["type"] == "ambulance" and r["available"] and r["etaMinutes"] <= 10), None)
         hospital = next((r for r in resources if r["type"] == "hospital" and r["available"]), None)
@@ -368,30 +400,20 @@ def community_response_coordinator(priority_output: Dict, location_hint: str = "
         "community_plan": plan_text,
         "resources_identified": str(len(plan)),
         "plan_note": "Illustrative resource coordination for demo",
-        "_priority": priority_output.get("_priority"),
+        "_priority": pr,
         "_plan": plan
     }
 
 # Orchestrator
-def orchestrate_case(payload: Dict):
-    case_id = str(uuid4())
-    # Use sequential case number if provided
-    case_id = str(payload.get("case_number", "1"))
-    intake = symptom_intake_agent(payload)
-    if "patientName" in payload:
-        intake["patientName"] = payload["patientName"]
-    
-    risk = risk_scoring_agent(intake)
-    severity = severity_prediction_agent(intake, risk)
-    doctor = doctor_recommendation_agent(intake)
-    priority = emergency_priority_classifier(severity, intake)
-    report = medical_report_agent(case_id, intake, risk, severity, doctor, priority)
-    community = community_response_coordinator(priority, payload.get("locationHint", "Community Zone A"))
-
-    # Build ledger with cleaned output (remove internal keys starting with _)
-    def clean_output(obj):
-        return {k: v for k, v in obj.items() if not k.startswith("_")}
-
+def clean_output(obj) -> Dict:
+    # Ledger view of an agent output: typed outputs render their display
+    # strings; dict outputs drop internal keys starting with _
+    if not isinstance(obj, dict):
+        return obj.ledger()
+    return {k: v for k, v in obj.items() if not k.startswith("_")}
+
+def _assemble_case(case_id: str, intake: Intake, risk: Risk, severity: Severity, doctor: Dict, priority: Priority, report: Dict, community: Dict):
+    # Build ledger with cleaned output
     ledger = [
         {"step": "intake", "output": clean_output(intake)},
         {"step": "risk", "output": clean_output(risk)},
@@ -403,11 +425,12 @@ def orchestrate_case(payload: Dict):
     ]
     
     final = {
-        "severityBand": severity.get("_severity", "unknown").lower(),
-        "priority": priority.get("_priority"),
+        "severityBand": severity.band,
+        "priority": priority.level,
         "specialties": doctor.get("_specialties", []),
         "report": report.get("_report", {}),
         "communityPlan": community.get("_plan", []),
+        "locationHint": community.get("location"),
     }
     
     return {
@@ -416,3 +439,140 @@ def orchestrate_case(payload: Dict):
         "ledger": ledger,
         "final": final
     }
+
+def _case_deadline(deadline: Optional[Deadline]) -> Deadline:
+    # Default end-to-end budget when the caller did not supply one
+    if deadline is None:
+        deadline = Deadline.from_ms(os.environ.get("TRIAGE_BUDGET_MS"))
+    return deadline
+
+def _priority_deadline(deadline: Deadline, priority: Priority) -> Deadline:
+    # P1 cases get a tighter budget so the rule-based answer is never held up
+    if priority.level == "P1":
+        p1 = Deadline.from_ms(os.environ.get("TRIAGE_P1_BUDGET_MS", "750"))
+        return deadline.tightened(p1.budget_seconds)
+    return deadline
+
+def orchestrate_case(payload: Dict, deadline: Optional[Deadline] = None):
+    case_id = str(uuid4())
+    # Use sequential case number if provided
+    case_id = str(payload.get("case_number", "1"))
+    deadline = _case_deadline(deadline)
+    intake = symptom_intake_agent(payload)
+    
+    risk = risk_scoring_agent(intake)
+    severity = severity_prediction_agent(intake, risk)
+    doctor = doctor_recommendation_agent(intake)
+    priority = emergency_priority_classifier(severity, intake)
+    deadline = _priority_deadline(deadline, priority)
+    report = medical_report_agent(case_id, intake, risk, severity, doctor, priority, deadline)
+    community = community_response_coordinator(priority, payload.get("locationHint", "Community Zone A"))
+    return _assemble_case(case_id, intake, risk, severity, doctor, priority, report, community)
+
+# Two-phase orchestration: a rule-only case is returned right away and the
+# LLM report is produced later from the same agent outputs.
+def orchestrate_rule_case(payload: Dict):
+    """Phase 1: run the rule agents only. Returns (case, steps) where `steps`
+    is what enrich_case needs to produce the enriched case."""
+    case_id = str(payload.get("case_number", "1"))
+    intake = symptom_intake_agent(payload)
+    risk = risk_scoring_agent(intake)
+    severity = severity_prediction_agent(intake, risk)
+    doctor = doctor_recommendation_agent(intake)
+    priority = emergency_priority_classifier(severity, intake)
+    report = _assemble_report(case_id, intake, risk, severity, doctor, priority, _PENDING)
+    community = community_response_coordinator(priority, payload.get("locationHint", "Community Zone A"))
+    steps = (intake, risk, severity, doctor, priority, community)
+    return _assemble_case(case_id, intake, risk, severity, doctor, priority, report, community), steps
+
+def enrich_case(case_id: str, steps):
+    """Phase 2: retrieval + LLM report for a case built by orchestrate_rule_case."""
+    intake, risk, severity, doctor, priority, community = steps
+    report = medical_report_agent(case_id, intake, risk, severity, doctor, priority)
+    return _assemble_case(case_id, intake, risk, severity, doctor, priority, report, community)
+
+# Async orchestrator
+# Retrieval, LLM and vector-store calls are network-bound, so they run on a
+# dedicated I/O pool (sized independently of the server's sync threadpool).
+# Retrieval starts as soon as intake is done and overlaps the rule agents;
+# indexing the case runs after the response is built.
+_IO_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("TRIAGE_IO_WORKERS", "64")), thread_name_prefix="triage-io")
+_BACKGROUND_TASKS = set()
+
+def _run_io(fn, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(_IO_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+async def _await_within(deadline: Deadline, fallback, awaitable):
+    remaining = deadline.remaining()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        return fallback
+
+def _spawn_background(awaitable):
+    # keep a reference so the task is not garbage-collected before it finishes
+    task = asyncio.ensure_future(awaitable)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+def _explain_case(doctor_output: Dict, severity: Severity) -> str:
+    """Plain-language explanation of the recommendations (best-effort)."""
+    try:
+        return _llm_service().explain_recommendations(doctor_output.get("_specialties", []), severity.band, severity.drivers) or ""
+    except Exception:
+        return ""
+
+def _template_explanation(doctor_output: Dict, severity: Severity) -> str:
+    # Used when the LLM fails or runs out of time, so the stream always explains
+    return (f"Recommended specialties: {', '.join(doctor_output.get('_specialties', []))}. "
+            f"Priority based on severity {severity.band} and drivers: {', '.join(severity.drivers) or 'none'}.")
+
+async def stream_case_events(payload: Dict, deadline: Optional[Deadline] = None, explain: bool = False):
+    """Async generator of (step, output) pairs in the order they become available.
+
+    Rule agents are yielded immediately, then "report" (and "explanation" when
+    `explain` is set: the LLM's text, or a template summary of the specialties
+    and drivers when it fails or times out), and finally ("case", case dict).
+    """
+    case_id = str(payload.get("case_number", "1"))
+    deadline = _case_deadline(deadline)
+    intake = symptom_intake_agent(payload)
+    retrieval = _run_io(_retrieve_context, _report_context_text(intake), timeout=deadline.remaining())
+    yield "intake", intake
+
+    risk = risk_scoring_agent(intake)
+    yield "risk", risk
+    severity = severity_prediction_agent(intake, risk)
+    yield "severity", severity
+    doctor = doctor_recommendation_agent(intake)
+    yield "doctor", doctor
+    priority = emergency_priority_classifier(severity, intake)
+    yield "priority", priority
+    community = community_response_coordinator(priority, payload.get("locationHint", "Community Zone A"))
+    yield "community", community
+    deadline = _priority_deadline(deadline, priority)
+
+    explanation = _run_io(_explain_case, doctor, severity) if explain else None
+    similar_cases = await _await_within(deadline, [], retrieval)
+    if deadline.expired():
+        enhanced = _SKIPPED
+    else:
+        enhanced = await _await_within(deadline, _SKIPPED, _run_io(_generate_enhanced_report, intake, severity, similar_cases, timeout=deadline.remaining()))
+    report = _assemble_report(case_id, intake, risk, severity, doctor, priority, enhanced)
+    yield "report", report
+    _spawn_background(_run_io(_index_case, case_id, intake, report))
+
+    if explanation is not None:
+        text = await _await_within(deadline, "", explanation) or _template_explanation(doctor, severity)
+        yield "explanation", {"agent": "explanation", "timestamp": now(), "text": text}
+    yield "case", _assemble_case(case_id, intake, risk, severity, doctor, priority, report, community)
+
+async def orchestrate_case_async(payload: Dict, deadline: Optional[Deadline] = None):
+    case = None
+    async for step, output in stream_case_events(payload, deadline):
+        if step == "case":
+            case = output
+    return case
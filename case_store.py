@@ -0,0 +1,667 @@
+"""Pluggable storage for triage cases.
+
+- CaseStore: the interface used by `main.py` (get / get_json / put / query / count / flush / close)
+- MemoryCaseStore: plain dict, for demos and tests
+- SQLiteCaseStore: durable SQLite (WAL) store; writes are buffered and
+  committed in batches by a background thread, bodies are zlib-compressed
+  compact JSON
+- CachedCaseStore: bounded LRU of hot cases in front of any other store
+
+Case numbers come from `allocate_case_number()`, which is atomic across
+threads and, for SQLite, across worker processes sharing the database file.
+In shared mode (CASE_STORE_SHARED=1, set by `gunicorn_conf.py`) a `put`
+returns only once the case is committed, so any worker can read it, and
+cached cases are revalidated against the stored version. SQLite stores
+reopen their connections and writer thread in forked children.
+
+`query()` lists cases newest first with cursor pagination, filtered by
+priority, severity band, specialty, location hint and created-at range. The
+filter keys come from `index_keys(case)` and are indexed on insert (SQLite
+columns and a specialty table, dicts of id sets in memory).
+
+Each case is serialized once, when it is put: `case_json(case)` gives its
+canonical JSON bytes, which every store keeps next to the case (SQLite
+stores them compressed) and `get_json` returns without re-encoding.
+
+`make_case_store()` builds the configured store from environment variables.
+"""
+import bisect
+import heapq
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fast_json import dumps, loads
+
+
+def _key(value) -> Optional[str]:
+    return None if value in (None, "") else str(value).strip().casefold()
+
+
+def index_keys(case: Dict) -> Dict:
+    """Normalized filter keys of a case (everything casefolded)."""
+    final = case.get("final") or {}
+    return {
+        "priority": _key(final.get("priority")),
+        "severityBand": _key(final.get("severityBand")),
+        "locationHint": _key(final.get("locationHint")),
+        "specialties": sorted({_key(sp) for sp in final.get("specialties") or [] if _key(sp)}),
+        "createdAt": case.get("createdAt", ""),
+    }
+
+
+def case_summary(case: Dict) -> Dict:
+    """Listing row for a case: identifiers and the triage outcome, no ledger."""
+    final = case.get("final") or {}
+    summary = (final.get("report") or {}).get("summary") or {}
+    return {
+        "caseId": case.get("caseId"),
+        "createdAt": case.get("createdAt", ""),
+        "version": case.get("version", 1),
+        "enrichment": case.get("enrichment"),
+        "patientName": summary.get("patientName"),
+        "priority": final.get("priority"),
+        "severityBand": final.get("severityBand"),
+        "specialties": final.get("specialties", []),
+        "locationHint": final.get("locationHint"),
+    }
+
+
+def _utc_timestamp(value: Optional[str]) -> Optional[str]:
+    # Cases store createdAt as datetime.utcnow().isoformat() + "Z", so bounds
+    # in that exact format compare correctly as strings
+    if value in (None, ""):
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"invalid ISO-8601 timestamp: {value!r}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class CaseQuery:
+    """Filters for `CaseStore.query`; string filters match case-insensitively.
+
+    `cursor` is the `nextCursor` of the previous page: only cases with a
+    lower case number are returned. `created_from` is inclusive and
+    `created_to` exclusive. Both accept any ISO-8601 timestamp or date (naive
+    values are taken as UTC) and are normalized to the stored `createdAt`
+    format; a value that does not parse raises ValueError.
+    """
+
+    def __init__(self, priority: Optional[str] = None, severity_band: Optional[str] = None,
+                 specialty: Optional[str] = None, location_hint: Optional[str] = None,
+                 created_from: Optional[str] = None, created_to: Optional[str] = None,
+                 cursor: Optional[str] = None, limit: int = 50):
+        self.priority = _key(priority)
+        self.severity_band = _key(severity_band)
+        self.specialty = _key(specialty)
+        self.location_hint = _key(location_hint)
+        self.created_from = _utc_timestamp(created_from)
+        self.created_to = _utc_timestamp(created_to)
+        self.before = int(cursor) if cursor and str(cursor).isdigit() else None
+        self.limit = max(1, min(int(limit), 500))
+
+
+def case_json(case: Dict) -> bytes:
+    """Canonical JSON bytes of a case, as stored and served."""
+    return dumps(case)
+
+
+def encode_case(case: Dict, data: Optional[bytes] = None) -> bytes:
+    return zlib.compress(case_json(case) if data is None else data, 6)
+
+
+def decode_case(blob: bytes) -> Dict:
+    return loads(zlib.decompress(blob))
+
+
+class CaseStore:
+    """Interface for case storage. Case ids are decimal case numbers."""
+
+    def get(self, case_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_json(self, case_id: str) -> Optional[bytes]:
+        """The case's canonical JSON bytes, None when missing."""
+        case = self.get(case_id)
+        return None if case is None else case_json(case)
+
+    def put(self, case_id: str, case: Dict, data: Optional[bytes] = None) -> None:
+        """Store a case; `data` is its `case_json` when the caller already has it."""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def query(self, q: CaseQuery) -> Tuple[List[Dict], Optional[str]]:
+        """Return (cases newest first, next cursor or None when exhausted)."""
+        raise NotImplementedError
+
+    def max_case_number(self) -> int:
+        """Highest stored case number, 0 when empty."""
+        raise NotImplementedError
+
+    def allocate_case_number(self) -> int:
+        """Reserve the next case number; never returns the same number twice."""
+        raise NotImplementedError
+
+    def version(self, case_id: str) -> Optional[int]:
+        """Stored version of a case, None when missing."""
+        case = self.get(case_id)
+        return None if case is None else case.get("version", 1)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemoryCaseStore(CaseStore):
+    """Dict-backed store. Case numbers and (createdAt, number) pairs are kept
+    sorted, so a listing walks back from the cursor and a created-at range is
+    a bisected slice rather than a scan."""
+
+    def __init__(self):
+        self._cases: Dict[str, Dict] = {}
+        self._json: Dict[str, bytes] = {}
+        self._counter_lock = threading.Lock()
+        self._last_number = 0
+        self._index_lock = threading.Lock()
+        self._keys: Dict[str, Dict] = {}
+        # field -> key -> case ids
+        self._index: Dict[str, Dict[str, set]] = {"priority": {}, "severityBand": {}, "locationHint": {}, "specialties": {}}
+        self._numbers: List[int] = []  # ascending case numbers
+        self._by_created: List[Tuple[str, int]] = []  # ascending (createdAt, case number)
+
+    def get(self, case_id: str) -> Optional[Dict]:
+        return self._cases.get(case_id)
+
+    def get_json(self, case_id: str) -> Optional[bytes]:
+        return self._json.get(case_id)
+
+    def put(self, case_id: str, case: Dict, data: Optional[bytes] = None) -> None:
+        keys = index_keys(case)
+        if data is None:
+            data = case_json(case)
+        with self._index_lock:
+            self._cases[case_id] = case
+            self._json[case_id] = data
+            old = self._keys.get(case_id)
+            for field, index in self._index.items():
+                for value in self._values(old, field):
+                    index[value].discard(case_id)
+                    if not index[value]:
+                        del index[value]
+                for value in self._values(keys, field):
+                    index.setdefault(value, set()).add(case_id)
+            self._keys[case_id] = keys
+            if case_id.isdigit():
+                self._order(int(case_id), old and old["createdAt"], keys["createdAt"])
+
+    def _order(self, number: int, old_created: Optional[str], created: str) -> None:
+        # Cases arrive in number order, so both inserts are usually appends
+        if old_created is None:
+            bisect.insort(self._numbers, number)
+        elif old_created != created:
+            del self._by_created[bisect.bisect_left(self._by_created, (old_created, number))]
+        if old_created != created:
+            bisect.insort(self._by_created, (created, number))
+
+    @staticmethod
+    def _values(keys: Optional[Dict], field: str) -> List[str]:
+        if keys is None:
+            return []
+        value = keys[field]
+        return value if isinstance(value, list) else [value] if value is not None else []
+
+    def _created_span(self, q: CaseQuery) -> Tuple[int, int]:
+        # Slice of _by_created inside [created_from, created_to)
+        lo = 0 if q.created_from is None else bisect.bisect_left(self._by_created, (q.created_from,))
+        hi = len(self._by_created) if q.created_to is None else bisect.bisect_left(self._by_created, (q.created_to,))
+        return lo, hi
+
+    def query(self, q: CaseQuery) -> Tuple[List[Dict], Optional[str]]:
+        wanted = [("priority", q.priority), ("severityBand", q.severity_band),
+                  ("locationHint", q.location_hint), ("specialties", q.specialty)]
+        with self._index_lock:
+            sets = sorted((self._index[field].get(value, set()) for field, value in wanted if value is not None), key=len)
+            lo, hi = self._created_span(q)
+            end = len(self._numbers) if q.before is None else bisect.bisect_left(self._numbers, q.before)
+
+            def matches(number: int) -> bool:
+                cid = str(number)
+                if not all(cid in ids for ids in sets):
+                    return False
+                created = self._keys[cid]["createdAt"]
+                return not ((q.created_from and created < q.created_from) or (q.created_to and created >= q.created_to))
+
+            if 8 * min([hi - lo] + [len(ids) for ids in sets[:1]]) >= end:
+                # Dense matches: walk back from the cursor until the page is full
+                numbers = []
+                for i in range(end - 1, -1, -1):
+                    if matches(self._numbers[i]):
+                        numbers.append(self._numbers[i])
+                        if len(numbers) > q.limit:
+                            break
+            else:
+                # Sparse matches: check the smallest candidate set, a filter's ids or the created-at slice
+                if sets and len(sets[0]) < hi - lo:
+                    candidates = (int(cid) for cid in sets[0] if cid.isdigit())
+                else:
+                    candidates = (number for _, number in self._by_created[lo:hi])
+                numbers = heapq.nlargest(q.limit + 1, (number for number in candidates
+                                                       if (q.before is None or number < q.before) and matches(number)))
+            page = [(number, self._cases[str(number)]) for number in numbers]
+        return _paginate(page, q.limit)
+
+    def count(self) -> int:
+        return len(self._cases)
+
+    def max_case_number(self) -> int:
+        return max((int(cid) for cid in self._cases if cid.isdigit()), default=0)
+
+    def allocate_case_number(self) -> int:
+        with self._counter_lock:
+            self._last_number += 1
+            return self._last_number
+
+
+def _paginate(rows: List[Tuple[int, Dict]], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    # `rows` holds up to limit + 1 (case number, case) pairs, newest first
+    cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+    return [case for _, case in rows[:limit]], cursor
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    priority TEXT,
+    severity_band TEXT,
+    location_hint TEXT,
+    body BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS case_specialties (
+    specialty TEXT NOT NULL,
+    case_id INTEGER NOT NULL,
+    PRIMARY KEY (specialty, case_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) SELECT 'case', COALESCE(MAX(id), 0) FROM cases;
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS cases_priority ON cases(priority);
+CREATE INDEX IF NOT EXISTS cases_severity_band ON cases(severity_band);
+CREATE INDEX IF NOT EXISTS cases_location_hint ON cases(location_hint);
+CREATE INDEX IF NOT EXISTS cases_created_at ON cases(created_at);
+CREATE INDEX IF NOT EXISTS case_specialties_case ON case_specialties(case_id);
+"""
+
+_INDEX_COLUMNS = ("priority", "severity_band", "location_hint")
+
+
+def _insert_cases(conn: sqlite3.Connection, batch: List[Tuple[str, Dict, Optional[bytes]]]) -> None:
+    # Caller holds the transaction; rewrites the case rows and their specialty index
+    rows, specialties = [], []
+    for cid, case, data in batch:
+        keys = index_keys(case)
+        rows.append((int(cid), keys["createdAt"], case.get("version", 1), keys["priority"],
+                     keys["severityBand"], keys["locationHint"], encode_case(case, data)))
+        specialties.extend((sp, int(cid)) for sp in keys["specialties"])
+    conn.executemany("INSERT OR REPLACE INTO cases (id, created_at, version, priority, severity_band, location_hint, body) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("DELETE FROM case_specialties WHERE case_id = ?", [(row[0],) for row in rows])
+    conn.executemany("INSERT INTO case_specialties (specialty, case_id) VALUES (?, ?)", specialties)
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Add the index columns to a cases table created before they existed and backfill them."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(cases)")}
+        missing = [c for c in _INDEX_COLUMNS if c not in columns]
+        for column in missing:
+            conn.execute(f"ALTER TABLE cases ADD COLUMN {column} TEXT")
+        if missing:
+            rows = conn.execute("SELECT id, body FROM cases").fetchall()
+            _insert_cases(conn, [(str(cid), decode_case(body), None) for cid, body in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    conn.executescript(_INDEXES)
+
+
+class SQLiteCaseStore(CaseStore):
+    """SQLite store with write-behind batching.
+
+    `put` only records the case in a pending buffer; a writer thread commits
+    the buffer in one transaction every `flush_interval` seconds or as soon
+    as `batch_size` cases are pending. Reads check the buffer first, so a
+    case is readable in this process as soon as it is put.
+
+    With `shared=True` (several worker processes on one file) `put` wakes the
+    writer and waits for the commit that includes its case, so concurrent
+    puts are still committed together but a case is visible to every process
+    once `put` returns.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, flush_interval: float = 0.05, shared: bool = False):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self._closed = False
+        self._start()
+        self._writer_conn.executescript(_SCHEMA)
+        _migrate(self._writer_conn)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self) -> None:
+        # Also runs in forked children: connections and threads do not survive a fork
+        self._pending: "OrderedDict[str, Tuple[Dict, bytes]]" = OrderedDict()  # id -> (case, case_json)
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flushed = threading.Condition(self._pending_lock)
+        self._put_seq = 0
+        self._committed_seq = 0
+        self._local = threading.local()
+        self._writer_conn = self._connect()
+        self._writer = threading.Thread(target=self._run, name="case-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _stored_body(self, case_id: str) -> Optional[bytes]:
+        if not case_id.isdigit():
+            return None
+        row = self._reader().execute("SELECT body FROM cases WHERE id = ?", (int(case_id),)).fetchone()
+        return row[0] if row else None
+
+    def get(self, case_id: str) -> Optional[Dict]:
+        with self._pending_lock:
+            entry = self._pending.get(case_id)
+        if entry is not None:
+            return entry[0]
+        body = self._stored_body(case_id)
+        return decode_case(body) if body is not None else None
+
+    def get_json(self, case_id: str) -> Optional[bytes]:
+        with self._pending_lock:
+            entry = self._pending.get(case_id)
+        if entry is not None:
+            return entry[1]
+        body = self._stored_body(case_id)
+        return zlib.decompress(body) if body is not None else None
+
+    def put(self, case_id: str, case: Dict, data: Optional[bytes] = None) -> None:
+        entry = (case, case_json(case) if data is None else data)
+        with self._pending_lock:
+            self._pending[case_id] = entry
+            self._pending.move_to_end(case_id)
+            self._put_seq += 1
+            seq = self._put_seq
+            full = len(self._pending) >= self.batch_size
+        if full or self.shared:
+            self._wakeup.set()
+        if self.shared:
+            self._wait_committed(seq)
+
+    def _wait_committed(self, seq: int) -> None:
+        with self._pending_lock:
+            while self._committed_seq < seq and self._writer.is_alive():
+                self._flushed.wait(0.5)
+
+    def _write_pending(self) -> None:
+        with self._pending_lock:
+            batch = list(self._pending.items())
+            seq = self._put_seq
+        if not batch:
+            return
+        conn = self._writer_conn
+        conn.execute("BEGIN")
+        try:
+            _insert_cases(conn, [(cid, case, data) for cid, (case, data) in batch])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._pending_lock:
+            # Only drop entries that were not replaced while we were writing
+            for cid, entry in batch:
+                if self._pending.get(cid) is entry:
+                    del self._pending[cid]
+            self._committed_seq = max(self._committed_seq, seq)
+            self._flushed.notify_all()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._write_pending()
+            except Exception as e:
+                print(f"Warning: case store write failed: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """Block until every case put so far is committed (or `timeout` passes)."""
+        with self._pending_lock:
+            if not self._pending:
+                return
+        self._wakeup.set()
+        give_up_at = time.monotonic() + timeout
+        with self._pending_lock:
+            while self._pending and self._writer.is_alive() and time.monotonic() < give_up_at:
+                self._flushed.wait(0.5)
+
+    def count(self) -> int:
+        with self._pending_lock:
+            pending = [int(cid) for cid in self._pending]
+        stored = self._reader().execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+        if not pending:
+            return stored
+        marks = ",".join("?" * len(pending))
+        overlap = self._reader().execute(f"SELECT COUNT(*) FROM cases WHERE id IN ({marks})", pending).fetchone()[0]
+        return stored + len(pending) - overlap
+
+    def query(self, q: CaseQuery) -> Tuple[List[Dict], Optional[str]]:
+        # Commit buffered cases first so the indexes cover everything put so far
+        with self._pending_lock:
+            seq = self._put_seq
+        if self._committed_seq < seq:
+            self._wakeup.set()
+            self._wait_committed(seq)
+        where, params = [], []
+        for column, value in (("priority", q.priority), ("severity_band", q.severity_band), ("location_hint", q.location_hint)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if q.specialty is not None:
+            where.append("id IN (SELECT case_id FROM case_specialties WHERE specialty = ?)")
+            params.append(q.specialty)
+        if q.created_from:
+            where.append("created_at >= ?")
+            params.append(q.created_from)
+        if q.created_to:
+            where.append("created_at < ?")
+            params.append(q.created_to)
+        if q.before is not None:
+            where.append("id < ?")
+            params.append(q.before)
+        sql = "SELECT id, body FROM cases"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._reader().execute(sql + " ORDER BY id DESC LIMIT ?", params + [q.limit + 1]).fetchall()
+        return _paginate([(cid, decode_case(body)) for cid, body in rows], q.limit)
+
+    def max_case_number(self) -> int:
+        with self._pending_lock:
+            pending = max((int(cid) for cid in self._pending), default=0)
+        stored = self._reader().execute("SELECT COALESCE(MAX(id), 0) FROM cases").fetchone()[0]
+        return max(pending, stored)
+
+    def allocate_case_number(self) -> int:
+        # A single UPDATE is atomic, so processes sharing the file never get the
+        # same number; fetchall() steps the statement to completion so it commits
+        return self._reader().execute("UPDATE counters SET value = value + 1 WHERE name = 'case' RETURNING value").fetchall()[0][0]
+
+    def version(self, case_id: str) -> Optional[int]:
+        with self._pending_lock:
+            entry = self._pending.get(case_id)
+        if entry is not None:
+            return entry[0].get("version", 1)
+        if not case_id.isdigit():
+            return None
+        row = self._reader().execute("SELECT version FROM cases WHERE id = ?", (int(case_id),)).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        self.flush()
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join(5.0)
+        self._write_pending()
+
+
+class _CacheEntry:
+    # A cached case as a dict, as canonical JSON, or both; the missing form is
+    # filled in from the other on first use
+    __slots__ = ("case", "data", "version")
+
+    def __init__(self, case: Optional[Dict], data: Optional[bytes], version: Optional[int]):
+        self.case = case
+        self.data = data
+        self.version = version
+
+
+class CachedCaseStore(CaseStore):
+    """Bounded LRU of hot cases in front of another store (read-through).
+
+    With `revalidate=True` a cache hit is checked against the backend's
+    stored version, which picks up updates made by other processes.
+    """
+
+    def __init__(self, backend: CaseStore, max_entries: int = 1024, revalidate: bool = False):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.revalidate = revalidate
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, case_id: str, entry: _CacheEntry) -> None:
+        with self._lock:
+            self._cache[case_id] = entry
+            self._cache.move_to_end(case_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _hit(self, case_id: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._cache.get(case_id)
+            if entry is not None:
+                self._cache.move_to_end(case_id)
+        if entry is not None and (not self.revalidate or self.backend.version(case_id) == entry.version):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def get(self, case_id: str) -> Optional[Dict]:
+        entry = self._hit(case_id)
+        if entry is not None:
+            if entry.case is None:
+                entry.case = loads(entry.data)
+            return entry.case
+        case = self.backend.get(case_id)
+        if case is not None:
+            self._remember(case_id, _CacheEntry(case, None, case.get("version", 1)))
+        return case
+
+    def get_json(self, case_id: str) -> Optional[bytes]:
+        entry = self._hit(case_id)
+        if entry is not None:
+            if entry.data is None:
+                entry.data = case_json(entry.case)
+            return entry.data
+        # Read the version first: if the case changes in between, the entry is
+        # older than its data and the next revalidation refetches it
+        version = self.backend.version(case_id) if self.revalidate else None
+        data = self.backend.get_json(case_id)
+        if data is not None:
+            self._remember(case_id, _CacheEntry(None, data, version))
+        return data
+
+    def put(self, case_id: str, case: Dict, data: Optional[bytes] = None) -> None:
+        if data is None:
+            data = case_json(case)
+        self.backend.put(case_id, case, data)
+        self._remember(case_id, _CacheEntry(case, data, case.get("version", 1)))
+
+    def count(self) -> int:
+        return self.backend.count()
+
+    def query(self, q: CaseQuery) -> Tuple[List[Dict], Optional[str]]:
+        return self.backend.query(q)
+
+    def max_case_number(self) -> int:
+        return self.backend.max_case_number()
+
+    def allocate_case_number(self) -> int:
+        return self.backend.allocate_case_number()
+
+    def version(self, case_id: str) -> Optional[int]:
+        return self.backend.version(case_id)
+
+    def flush(self) -> None:
+        self.backend.flush()
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+def make_case_store() -> CaseStore:
+    """CASE_STORE=sqlite (default) or memory; CASE_STORE_PATH, CASE_CACHE_SIZE, CASE_STORE_SHARED."""
+    kind = os.environ.get("CASE_STORE", "sqlite").lower()
+    shared = os.environ.get("CASE_STORE_SHARED", "0").lower() in ("1", "true", "yes")
+    if kind == "memory":
+        if shared:
+            print("Warning: CASE_STORE=memory is per-process; workers will not see each other's cases")
+        return MemoryCaseStore()
+    backend = SQLiteCaseStore(
+        os.environ.get("CASE_STORE_PATH", "triage_cases.db"),
+        batch_size=int(os.environ.get("CASE_STORE_BATCH_SIZE", "256")),
+        flush_interval=float(os.environ.get("CASE_STORE_FLUSH_MS", "50")) / 1000.0,
+        shared=shared,
+    )
+    return CachedCaseStore(backend, max_entries=int(os.environ.get("CASE_CACHE_SIZE", "1024")), revalidate=shared)
+
+
+__all__ = ["CaseQuery", "index_keys", "case_summary", "CaseStore", "MemoryCaseStore", "SQLiteCaseStore", "CachedCaseStore", "make_case_store", "case_json", "encode_case", "decode_case"]
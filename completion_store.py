@@ -0,0 +1,116 @@
+"""Persistent on-disk store for LLM completions.
+
+Backs the in-memory completion cache in `llm_service` with a local SQLite
+file so common prompts survive restarts. Entries are keyed by a hash of the
+normalized prompt plus model, carry hit counts for warm-loading the hottest
+entries at startup, and are evicted least-recently-used once the stored
+responses exceed a byte budget. Uses only the standard library and never
+touches the network.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS completions_last_used ON completions(last_used);
+CREATE INDEX IF NOT EXISTS completions_hits ON completions(hits);
+"""
+
+
+class CompletionStore:
+    """SQLite completion store with TTL and byte-budget LRU eviction."""
+
+    # Eviction scans the table, so it only runs every few writes
+    EVICT_EVERY = 32
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+        self._open()
+        self._conn.executescript(_SCHEMA)
+        if hasattr(os, "register_at_fork"):
+            # SQLite connections must not be shared with forked workers
+            os.register_at_fork(after_in_child=self._open)
+
+    def _open(self) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM completions WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE completions SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO completions (key, model, response, size, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT(key) DO UPDATE SET response = excluded.response, size = excluded.size, "
+                "created_at = excluded.created_at, last_used = excluded.last_used",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict_locked(now)
+
+    def hottest(self, limit: int) -> List[Tuple[str, str]]:
+        """Return (key, response) for the most-hit live entries, hottest first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, response FROM completions WHERE created_at > ? ORDER BY hits DESC, last_used DESC LIMIT ?",
+                (time.time() - self.ttl_seconds, limit),
+            ).fetchall()
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict_locked(time.time())
+
+    def _evict_locked(self, now: float) -> None:
+        self._conn.execute("DELETE FROM completions WHERE created_at <= ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Walk entries oldest-use first until enough bytes are freed
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM completions ORDER BY last_used ASC"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        return {"path": self.path, "entries": count, "bytes": total, "maxBytes": self.max_bytes, "ttlSeconds": self.ttl_seconds}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+__all__ = ["CompletionStore"]
@@ -0,0 +1,47 @@
+"""Per-case latency budget passed through the orchestrator.
+
+A `Deadline` is created when a triage request arrives and handed down to
+the retrieval and LLM calls, which use `remaining()` as their timeout. An
+unbounded deadline (no budget) reports `None` and never expires.
+"""
+import time
+from typing import Optional
+
+
+class Deadline:
+    def __init__(self, budget_seconds: Optional[float] = None, started_at: Optional[float] = None):
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.budget_seconds = budget_seconds
+        self.expires_at = None if budget_seconds is None else self.started_at + budget_seconds
+
+    @classmethod
+    def from_ms(cls, budget_ms) -> "Deadline":
+        """Build a deadline from a millisecond budget; empty/None/<=0 means unbounded."""
+        try:
+            ms = float(budget_ms)
+        except (TypeError, ValueError):
+            return cls(None)
+        return cls(ms / 1000.0 if ms > 0 else None)
+
+    def tightened(self, budget_seconds: Optional[float]) -> "Deadline":
+        """Return a deadline no later than `budget_seconds` after the same start."""
+        if budget_seconds is None:
+            return self
+        if self.budget_seconds is not None and self.budget_seconds <= budget_seconds:
+            return self
+        return Deadline(budget_seconds, started_at=self.started_at)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (never negative), or None when unbounded."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started_at) * 1000.0
+
+
+__all__ = ["Deadline"]
@@ -1,174 +1,338 @@
 """
 embeddings_service.py
 
-Lightweight embeddings helper with safe fallbacks so imports succeed
-in environments without `chromadb` or `openai` installed. Exposes:
-- retrieve_similar_cases(text, k=3) -> list of dicts
+Optional embeddings + vector DB (Chroma) service, with safe fallbacks so
+imports succeed in environments without `chromadb` or `openai` installed.
+Exposes:
+- retrieve_similar_cases(text, k=3) -> list of similar case texts
 - upsert_case(case_id, text) -> bool
+- embed_text(text) -> memoized OpenAI embedding, or None
+- flush_writes() / close_writes() for the write-behind upsert queue
 
-This module is defensive: when optional libs are missing it returns
-empty results or no-ops so the demo continues to work.
+This module is defensive: when the vector DB or OpenAI embeddings are
+unusable it falls back to an in-memory BM25 keyword index so retrieval
+keeps working in the demo.
 """
-from typing import List, Dict, Optional
+from array import array
+from collections import Counter, OrderedDict
+from typing import List, Dict, Optional, Tuple
+import atexit
+import base64
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
 import warnings
 
-CHROMA_AVAILABLE = False
-OPENAI_AVAILABLE = False
+import startup
+import vector_store  # shared, lazily connected Chroma client/collection
+
+CHROMA_AVAILABLE = vector_store._HAS_CHROMA
+# openai is imported on the first embedding request
+OPENAI_AVAILABLE = startup.available("openai")
+_HAS_OPENAI = OPENAI_AVAILABLE
+_openai = startup.lazy("openai")
 
-try:
-    import chromadb  # type: ignore
-    from chromadb.config import Settings  # type: ignore
-    CHROMA_AVAILABLE = True
-except Exception:
-    warnings.warn("chromadb not available; embeddings will be no-op")
+if not CHROMA_AVAILABLE:
+    warnings.warn("chromadb not available; using in-memory keyword index")
 
-try:
-    import openai  # type: ignore
-    OPENAI_AVAILABLE = True
-except Exception:
+if not OPENAI_AVAILABLE:
     warnings.warn("openai package not available; embeddings will be no-op")
 
-# Simple in-memory fallback index
-_IN_MEMORY_INDEX: Dict[str, str] = {}
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
 
-def retrieve_similar_cases(text: str, k: int = 3) -> List[Dict[str, str]]:
-    """Return up to `k` similar cases. If chromadb is not available,
-    perform a naive substring match against an in-memory index.
-    """
-    if CHROMA_AVAILABLE:
-        try:
-            client = chromadb.Client(Settings())
-            # use a simple collections-based approach if available
-            col = client.get_or_create_collection("cases")
-            # chromadb query requires embeddings; safe fallback to empty
-            results = col.query(query_texts=[text], n_results=k)
-            hits = []
-            for ids, metadatas in zip(results.get("ids", []), results.get("metadatas", [])):
-                pass
-            # We return an empty list for now as complex chroma wiring
-            return []
-        except Exception:
-            return []
-
-    # Fallback: naive substring scoring
-    text_l = (text or "").lower()
-    scored = []
-    for cid, doc in _IN_MEMORY_INDEX.items():
-        score = 0
-        dl = doc.lower()
-        if text_l and text_l in dl:
-            score = 10
-        else:
-            # count shared words
-            words = set(text_l.split())
-            common = sum(1 for w in words if w and w in dl)
-            score = common
-        if score > 0:
-            scored.append((score, cid, doc))
-    scored.sort(reverse=True)
-    results = []
-    for score, cid, doc in scored[:k]:
-        results.append({"case_id": cid, "text": doc, "score": score})
-    return results
-
-def upsert_case(case_id: str, text: str) -> bool:
-    """Store the case text in the fallback index. If chromadb is available,
-    a best-effort upsert would be performed (not implemented here).
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class _CaseIndex:
+    """Incrementally maintained token inverted index scored with BM25.
+
+    Postings map token -> {case_id: term frequency}, so a query only touches
+    cases sharing a term with it. Tokens present in more than `max_df_ratio`
+    of all cases (field labels such as "patient" or "symptoms") carry almost
+    no weight and are skipped unless nothing else matches. Once `max_docs`
+    cases are stored, the least recently upserted case is evicted.
     """
-    if CHROMA_AVAILABLE:
-        try:
-            client = chromadb.Client(Settings())
-            col = client.get_or_create_collection("cases")
-            # production code would compute embeddings and upsert here
-            # keep as a no-op to avoid hard dependency
-            return True
-        except Exception:
-            pass
 
-    # fallback: store in-memory
+    def __init__(self, max_docs: int = 100000, k1: float = 1.2, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.max_docs = max_docs
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._docs: "OrderedDict[str, Tuple[str, Counter, int]]" = OrderedDict()  # id -> (text, terms, length)
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_len = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def upsert(self, case_id: str, text: str) -> None:
+        terms = Counter(_tokenize(text))
+        length = sum(terms.values())
+        with self._lock:
+            self._remove_locked(case_id)
+            self._docs[case_id] = (text, terms, length)
+            self._total_len += length
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[case_id] = tf
+            while len(self._docs) > self.max_docs:
+                self._remove_locked(next(iter(self._docs)))
+
+    def remove(self, case_id: str) -> None:
+        with self._lock:
+            self._remove_locked(case_id)
+
+    def _remove_locked(self, case_id: str) -> None:
+        entry = self._docs.pop(case_id, None)
+        if entry is None:
+            return
+        _, terms, length = entry
+        self._total_len -= length
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(case_id, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[float, str, str]]:
+        """Return up to `k` (score, case_id, text) tuples, best first."""
+        query = set(_tokenize(text))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not query or k <= 0:
+                return []
+            avgdl = self._total_len / n
+            postings = [(t, self._postings[t]) for t in query if t in self._postings]
+            selective = [(t, p) for t, p in postings if len(p) <= self.max_df_ratio * n]
+            scores: Dict[str, float] = {}
+            docs, k1, b = self._docs, self.k1, self.b
+            for term, posting in (selective or postings):
+                df = len(posting)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for cid, tf in posting.items():
+                    norm = k1 * (1 - b + b * docs[cid][2] / avgdl)
+                    scores[cid] = scores.get(cid, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, cid, self._docs[cid][0]) for cid, score in top]
+
+
+# In-memory fallback index used whenever the vector DB path is unavailable
+_IN_MEMORY_INDEX = _CaseIndex(max_docs=int(os.environ.get("EMBEDDINGS_MEMORY_MAX_CASES", "100000")))
+
+def _memory_retrieve(text: str, k: int = 3) -> List[Dict[str, str]]:
+    """Return up to `k` similar cases from the in-memory BM25 index."""
+    return [{"case_id": cid, "text": doc, "score": score} for score, cid, doc in _IN_MEMORY_INDEX.search(text, k)]
+
+def _memory_upsert(case_id: str, text: str) -> bool:
+    """Store (or replace) the case text in the in-memory index."""
     try:
-        _IN_MEMORY_INDEX[case_id] = text or ""
+        _IN_MEMORY_INDEX.upsert(case_id, text or "")
         return True
     except Exception:
         return False
 
-__all__ = ["retrieve_similar_cases", "upsert_case"]
-"""Optional embeddings + vector DB (Chroma) service.
 
-Provides upsert_case(text) and retrieve_similar_cases(text, k).
-Falls back to no-op if chromadb or OpenAI embeddings unavailable.
-"""
-import os
-from typing import List
-
-_HAS_CHROMA = False
-_HAS_OPENAI = False
-try:
-    import chromadb  # type: ignore
-    from chromadb.config import Settings  # type: ignore
-    _HAS_CHROMA = True
-except Exception:
-    _HAS_CHROMA = False
-
-try:
-    import openai  # type: ignore
-    _HAS_OPENAI = True
-except Exception:
-    _HAS_OPENAI = False
-
-COLLECTION_NAME = os.environ.get("CHROMA_COLLECTION", "cases")
-_client = None
-_collection = None
-
-if _HAS_CHROMA:
+# "chroma" (default: Chroma + OpenAI, falling back to the keyword index) or
+# "local" (offline hashing embeddings in a NumPy matrix, see local_embeddings)
+EMBEDDINGS_BACKEND = os.environ.get("EMBEDDINGS_BACKEND", "chroma").lower()
+_LOCAL_INDEX = None
+if EMBEDDINGS_BACKEND == "local":
     try:
-        _client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory="./chroma_db"))
-        # create or get collection
-        try:
-            _collection = _client.get_collection(COLLECTION_NAME)
-        except Exception:
-            _collection = _client.create_collection(COLLECTION_NAME)
-    except Exception:
-        _HAS_CHROMA = False
+        from local_embeddings import VectorIndex
+        _LOCAL_INDEX = VectorIndex(max_rows=int(os.environ.get("EMBEDDINGS_MEMORY_MAX_CASES", "100000")))
+    except Exception as e:
+        warnings.warn(f"local embeddings not available ({e}); using configured backend")
 
 
-def _embed_text_openai(text: str):
+def _embedding_model() -> str:
+    return os.environ.get("OPENAI_EMBEDDING", "text-embedding-3-small")
+
+
+def _embed_text_openai(text: str, timeout: Optional[float] = None):
     if not _HAS_OPENAI:
         return None
+    extra = {"request_timeout": timeout} if timeout is not None else {}
     try:
-        resp = openai.Embedding.create(model=os.environ.get("OPENAI_EMBEDDING", "text-embedding-3-small"), input=text)
+        resp = _openai().Embedding.create(model=_embedding_model(), input=text, **extra)
         return resp["data"][0]["embedding"]
     except Exception:
         return None
 
 
-def upsert_case(case_id: str, text: str) -> bool:
-    """Store case text in vector DB. Returns True if stored."""
-    if not _HAS_CHROMA:
-        return False
-    emb = _embed_text_openai(text)
+# Embedding memo keyed by a content hash of (model, text): an LRU of
+# EMBEDDING_CACHE_SIZE vectors, optionally persisted to SQLite through the
+# completion store when EMBEDDING_CACHE_DB is set (vectors packed as float32).
+_EMBED_CACHE: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMBED_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+_EMBED_CACHE_LOCK = threading.Lock()
+_EMBED_DISK = None
+if os.environ.get("EMBEDDING_CACHE_DB"):
+    try:
+        from completion_store import CompletionStore
+        _EMBED_DISK = CompletionStore(os.environ["EMBEDDING_CACHE_DB"],
+                                      max_bytes=int(float(os.environ.get("EMBEDDING_CACHE_DB_MAX_MB", "200")) * 1024 * 1024),
+                                      ttl_seconds=float(os.environ.get("EMBEDDING_CACHE_DB_TTL_SECONDS", str(30 * 24 * 3600))))
+    except Exception as e:
+        warnings.warn(f"embedding disk cache not available: {e}")
+
+
+def _embedding_key(text: str) -> str:
+    return hashlib.sha256(f"{_embedding_model()}\x1f{text or ''}".encode("utf-8")).hexdigest()
+
+
+def _memo_get(key: str) -> Optional[List[float]]:
+    with _EMBED_CACHE_LOCK:
+        vec = _EMBED_CACHE.get(key)
+        if vec is not None:
+            _EMBED_CACHE.move_to_end(key)
+            return vec
+    if _EMBED_DISK is not None:
+        packed = _EMBED_DISK.get(key)
+        if packed is not None:
+            vec = array("f", base64.b64decode(packed)).tolist()
+            _memo_put(key, vec, persist=False)
+            return vec
+    return None
+
+
+def _memo_put(key: str, vec: List[float], persist: bool = True) -> None:
+    if _EMBED_CACHE_SIZE > 0:
+        with _EMBED_CACHE_LOCK:
+            _EMBED_CACHE[key] = vec
+            _EMBED_CACHE.move_to_end(key)
+            while len(_EMBED_CACHE) > _EMBED_CACHE_SIZE:
+                _EMBED_CACHE.popitem(last=False)
+    if persist and _EMBED_DISK is not None:
+        try:
+            _EMBED_DISK.put(key, _embedding_model(), base64.b64encode(array("f", vec).tobytes()).decode("ascii"))
+        except Exception:
+            pass
+
+
+def embed_text(text: str, timeout: Optional[float] = None) -> Optional[List[float]]:
+    """Return the (memoized) OpenAI embedding of `text`, or None if unavailable."""
+    key = _embedding_key(text)
+    vec = _memo_get(key)
+    if vec is None:
+        vec = _embed_text_openai(text, timeout)
+        if vec is not None:
+            _memo_put(key, vec)
+    return vec
+
+
+def _embed_texts_openai(texts: List[str]) -> Optional[List]:
+    """Embed several texts with a single multi-input embedding request."""
+    if not _HAS_OPENAI or not texts:
+        return None
+    try:
+        resp = _openai().Embedding.create(model=_embedding_model(), input=texts)
+        data = sorted(resp["data"], key=lambda d: d.get("index", 0))
+        return [d["embedding"] for d in data]
+    except Exception:
+        return None
+
+
+def _write_batch(items: List) -> None:
+    """Embed, upsert and persist one micro-batch of (case_id, text, embed_from) items.
+
+    Memoized embeddings are reused; the rest are fetched in one request.
+    """
+    sources = [embed_from or text for _, text, embed_from in items]
+    keys = [_embedding_key(src) for src in sources]
+    vectors = [_memo_get(key) for key in keys]
+    missing = [i for i, vec in enumerate(vectors) if vec is None]
+    if missing:
+        fresh = _embed_texts_openai([sources[i] for i in missing])
+        if fresh is not None and len(fresh) == len(missing):
+            for i, vec in zip(missing, fresh):
+                vectors[i] = vec
+                _memo_put(keys[i], vec)
+    ready = [(item, vec) for item, vec in zip(items, vectors) if vec is not None]
+    for (cid, text, _), vec in zip(items, vectors):
+        if vec is None:
+            _memory_upsert(cid, text)
+    if not ready:
+        return
+    ids = [item[0] for item, _ in ready]
+    texts = [item[1] for item, _ in ready]
+    embeddings = [vec for _, vec in ready]
+    vector_store.with_collection(lambda col: col.upsert(ids=ids, documents=texts, embeddings=embeddings))
+    vector_store.persist()
+
+
+# Write-behind indexing (INDEX_WRITE_BEHIND=0 to upsert synchronously)
+_WRITER = None
+if os.environ.get("INDEX_WRITE_BEHIND", "1") != "0":
+    from index_writer import WriteBehindQueue
+    _WRITER = WriteBehindQueue(
+        _write_batch,
+        max_batch=int(os.environ.get("INDEX_BATCH_SIZE", "64")),
+        window_seconds=float(os.environ.get("INDEX_BATCH_WINDOW_MS", "250")) / 1000.0,
+        capacity=int(os.environ.get("INDEX_QUEUE_CAPACITY", "10000")),
+    )
+    atexit.register(_WRITER.close)
+
+
+def flush_writes() -> None:
+    """Block until queued upserts have been written to the vector DB."""
+    if _WRITER is not None:
+        _WRITER.flush()
+
+
+def close_writes() -> None:
+    """Drain queued upserts and stop the writer (call on shutdown)."""
+    if _WRITER is not None:
+        _WRITER.close()
+
+
+def upsert_case(case_id: str, text: str, embed_from: Optional[str] = None) -> bool:
+    """Store case text in vector DB. Returns True if stored (or queued).
+
+    `embed_from` names the text whose embedding is stored with the document
+    (default: `text`); passing the retrieval query reuses its memoized vector.
+    """
+    if _LOCAL_INDEX is not None:
+        _LOCAL_INDEX.upsert(case_id, text or "")
+        return True
+    if not vector_store.available():
+        return _memory_upsert(case_id, text)
+    # Queue for a batched write; a full queue falls through to a direct write
+    if _WRITER is not None and _WRITER.submit(case_id, text, embed_from):
+        return True
+    emb = embed_text(embed_from or text)
     if emb is None:
-        return False
+        return _memory_upsert(case_id, text)
     try:
-        _collection.upsert(ids=[case_id], documents=[text], embeddings=[emb])
-        _client.persist()
+        vector_store.with_collection(lambda col: col.upsert(ids=[case_id], documents=[text], embeddings=[emb]))
+        vector_store.persist()
         return True
     except Exception:
         return False
 
 
-def retrieve_similar_cases(text: str, k: int = 3) -> List[str]:
+def retrieve_similar_cases(text: str, k: int = 3, timeout: Optional[float] = None) -> List[str]:
     """Return list of similar case texts (strings)."""
-    if not _HAS_CHROMA:
-        return []
-    emb = _embed_text_openai(text)
+    if _LOCAL_INDEX is not None:
+        return [doc for _, _, doc in _LOCAL_INDEX.search(text, k)]
+    if not vector_store.available():
+        return [hit["text"] for hit in _memory_retrieve(text, k)]
+    emb = embed_text(text, timeout)
     if emb is None:
-        return []
+        return [hit["text"] for hit in _memory_retrieve(text, k)]
     try:
-        results = _collection.query(embeddings=[emb], n_results=k)
+        results = vector_store.with_collection(lambda col: col.query(embeddings=[emb], n_results=k))
         docs = results.get("documents")
         if docs and len(docs) > 0:
             return docs[0]
     except Exception:
         return []
     return []
+
+
+__all__ = ["retrieve_similar_cases", "upsert_case", "embed_text", "flush_writes", "close_writes"]
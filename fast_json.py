@@ -0,0 +1,60 @@
+"""JSON encoding for stored cases and API responses.
+
+`dumps` returns compact UTF-8 bytes, using orjson when it is installed and
+the standard library otherwise. Cases are encoded once with `dumps` when
+they are stored, and reads serve those bytes as-is. `FastJSONResponse` is
+a JSONResponse that renders with the same encoder.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse  # type: ignore
+
+_HAS_ORJSON = False
+try:
+    import orjson  # type: ignore
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
+
+def dumps(obj: Any) -> bytes:
+    if _HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data) -> Any:
+    if _HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def benchmark(n: int = 2000) -> dict:
+    """Encode a full triage case with the stdlib encoder and with `dumps`."""
+    import time
+    from agents import orchestrate_rule_case
+    case, _ = orchestrate_rule_case({"case_number": 1, "age": 60, "patientName": "A", "symptomsText": "chest pain, SOB, fever",
+                                     "vitals": {"spo2": 90, "heartRate": 130}})
+    t0 = time.perf_counter()
+    for _ in range(n):
+        json.dumps(case).encode("utf-8")
+    stdlib = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        dumps(case)
+    fast = time.perf_counter() - t0
+    return {"orjson": _HAS_ORJSON, "bytes": len(dumps(case)), "stdlibMicros": round(stdlib / n * 1e6, 1),
+            "dumpsMicros": round(fast / n * 1e6, 1)}
+
+
+__all__ = ["dumps", "loads", "FastJSONResponse"]
+
+
+if __name__ == "__main__":
+    print(benchmark())
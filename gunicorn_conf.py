@@ -0,0 +1,31 @@
+"""Gunicorn settings for running the API with several worker processes.
+
+    gunicorn -c gunicorn_conf.py main:app
+
+The app is imported once in the master (`preload_app`), the spaCy model and
+other heavy modules are loaded there by `main.preload()`, and the workers are
+forked from that warm process. Cases go to the shared SQLite store
+(CASE_STORE_PATH) with CASE_STORE_SHARED=1, so case numbers are allocated
+atomically across workers and any worker can serve any case.
+
+Environment: WEB_CONCURRENCY (workers, default: CPU count), BIND
+(default 0.0.0.0:8000), GUNICORN_TIMEOUT (seconds, default 120).
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault("CASE_STORE_SHARED", "1")
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker is forked
+    from main import preload
+    preload()
+    server.log.info("Preloaded models; forking %s workers", workers)
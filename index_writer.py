@@ -0,0 +1,105 @@
+"""Write-behind queue that batches vector-store upserts off the request path.
+
+Callers `submit()` (case_id, text, embed_from) items and return immediately. A single
+background thread collects them into micro-batches, closing a batch once
+`max_batch` items arrive or `window_seconds` pass after the first item, and
+hands each batch to a `write_batch(items)` callback. The queue is bounded.
+When it is full, `submit()` blocks for up to `put_timeout` seconds and then
+returns False so the caller can write synchronously; that is the
+backpressure. `close()` drains whatever is queued before stopping.
+"""
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+Item = Tuple[str, str, Optional[str]]  # (case_id, text, text whose embedding to store)
+
+
+class WriteBehindQueue:
+    def __init__(self, write_batch: Callable[[List[Item]], None], max_batch: int = 64,
+                 window_seconds: float = 0.25, capacity: int = 10000, put_timeout: float = 0.05):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.window_seconds = window_seconds
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue[Item]" = queue.Queue(maxsize=capacity)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.written = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="index-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, case_id: str, text: str, embed_from: Optional[str] = None) -> bool:
+        """Queue an upsert; False when the queue stayed full for `put_timeout`."""
+        if self._stop.is_set():
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put((case_id, text, embed_from), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def _next_batch(self) -> List[Item]:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        closes_at = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = closes_at - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            # Later submissions for the same case win within a batch
+            latest = {item[0]: item for item in batch}
+            try:
+                self.write_batch(list(latest.values()))
+                self.batches += 1
+                self.written += len(latest)
+            except Exception as e:
+                self.errors += 1
+                print(f"Warning: index write-behind batch failed ({len(latest)} cases): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        """Block until everything submitted so far has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting work, drain the queue and stop the writer thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "batches": self.batches, "written": self.written,
+                "rejected": self.rejected, "errors": self.errors}
+
+
+__all__ = ["WriteBehindQueue"]
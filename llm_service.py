@@ -3,40 +3,222 @@
 Provides:
 - generate_personalized_first_aid(symptoms, severity, vitals) -> List[str]
 - explain_recommendations(specialties, severity, drivers) -> str
+- generate_case_report(case_summary, similar_cases) -> dict
+- clinical_basis(case_summary) -> dict (the de-identified inputs a case report is built from)
+- cache_stats() -> dict (hit/miss counters of the completion cache)
 
 If `openai` is unavailable or `OPENAI_API_KEY` is not set, the module falls back to safe, fast heuristics.
+The `openai` package is imported on the first completion, not with this module.
 """
+import hashlib
+import json
 import os
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import startup
 
 OPENAI_KEY = os.environ.get("OPENAI_API_KEY")
-_HAS_OPENAI = False
-try:
-    import openai  # type: ignore
-    if OPENAI_KEY:
-        openai.api_key = OPENAI_KEY
-        _HAS_OPENAI = True
-except Exception:
-    _HAS_OPENAI = False
-
-
-def _call_chat(prompt: str, temperature: float = 0.2, max_tokens: int = 400) -> str:
-    """Call OpenAI chat completion if available, otherwise return empty string."""
-    if not _HAS_OPENAI:
-        return ""
+_HAS_OPENAI = bool(OPENAI_KEY) and startup.available("openai")
+_openai_module = None
+
+
+def _openai():
+    global _openai_module
+    if _openai_module is None:
+        module = startup.load("openai")
+        module.api_key = OPENAI_KEY
+        _openai_module = module
+    return _openai_module
+
+
+class _ResponseCache:
+    """Thread-safe LRU cache of chat completions with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, record: bool = True) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += record
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += record
+            return None
+
+    def put(self, key, value: str) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_CACHE = _ResponseCache(
+    max_entries=int(os.environ.get("LLM_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.environ.get("LLM_CACHE_TTL_SECONDS", "3600")),
+)
+
+
+def _cache_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    # Collapse whitespace and case so trivially different prompts share an entry;
+    # hashed so the same key addresses both the memory and the disk store
+    normalized = " ".join((prompt or "").split()).casefold()
+    raw = f"{model}\x1f{round(float(temperature), 3)}\x1f{max_tokens}\x1f{normalized}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Optional persistent store (LLM_CACHE_DB=/path/to/file.sqlite). The hottest
+# entries are loaded into the memory cache at import so restarts start warm.
+_DISK_CACHE = None
+if os.environ.get("LLM_CACHE_DB"):
     try:
-        resp = openai.ChatCompletion.create(
-            model=os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo"),
+        from completion_store import CompletionStore
+        _DISK_CACHE = CompletionStore(
+            os.environ["LLM_CACHE_DB"],
+            max_bytes=int(float(os.environ.get("LLM_CACHE_DB_MAX_MB", "50")) * 1024 * 1024),
+            ttl_seconds=float(os.environ.get("LLM_CACHE_DB_TTL_SECONDS", str(7 * 24 * 3600))),
+        )
+        # coldest first, so the hottest entries end up most-recently-used
+        for _key, _response in reversed(_DISK_CACHE.hottest(int(os.environ.get("LLM_CACHE_WARM_ENTRIES", str(_CACHE.max_entries))))):
+            _CACHE.put(_key, _response)
+    except Exception as e:
+        print(f"Warning: LLM disk cache not available: {e}")
+        _DISK_CACHE = None
+
+
+def cache_stats() -> dict:
+    """Return hit/miss counters and occupancy of the completion cache."""
+    stats = _CACHE.stats()
+    with _INFLIGHT_LOCK:
+        stats["inFlight"] = len(_INFLIGHT)
+        stats["coalesced"] = _COALESCED
+    if _DISK_CACHE is not None:
+        stats["disk"] = _DISK_CACHE.stats()
+    return stats
+
+
+class _Flight:
+    """A completion in progress that concurrent identical callers wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = ""
+
+
+_INFLIGHT = {}  # cache key -> _Flight
+_INFLIGHT_LOCK = threading.Lock()
+_COALESCED = 0
+
+
+def _lookup_cached(key: str, record: bool = True) -> Optional[str]:
+    cached = _CACHE.get(key, record=record)
+    if cached is None and _DISK_CACHE is not None:
+        cached = _DISK_CACHE.get(key)
+        if cached is not None:
+            _CACHE.put(key, cached)
+    return cached
+
+
+def _complete(prompt: str, model: str, temperature: float, max_tokens: int, timeout: Optional[float] = None) -> str:
+    extra = {"request_timeout": timeout} if timeout is not None else {}
+    try:
+        resp = _openai().ChatCompletion.create(
+            model=model,
             messages=[{"role": "system", "content": "You are a helpful medical triage assistant. Provide concise, safety-first first-aid steps and explainable recommendations. Keep answers short."},
                       {"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens,
+            **extra,
         )
         return resp.choices[0].message.content.strip()
     except Exception:
         return ""
 
 
+def _call_chat(prompt: str, temperature: float = 0.2, max_tokens: int = 400, timeout: Optional[float] = None) -> str:
+    """Call OpenAI chat completion if available, otherwise return empty string.
+
+    Non-empty completions are cached by normalized prompt, model and
+    temperature (LLM_CACHE_SIZE entries, LLM_CACHE_TTL_SECONDS each), and
+    also written to the disk store when LLM_CACHE_DB is set. Concurrent
+    callers with the same key share a single in-flight request. `timeout`
+    (seconds) bounds both the upstream request and time spent waiting on
+    another caller's request; on expiry an empty string is returned.
+    """
+    global _COALESCED
+    if not _HAS_OPENAI:
+        return ""
+    model = os.environ.get("OPENAI_MODEL", "gpt-3.5-turbo")
+    key = _cache_key(prompt, model, temperature, max_tokens)
+    cached = _lookup_cached(key)
+    if cached is not None:
+        return cached
+
+    with _INFLIGHT_LOCK:
+        flight = _INFLIGHT.get(key)
+        leader = flight is None
+        if leader:
+            flight = _INFLIGHT[key] = _Flight()
+        else:
+            _COALESCED += 1
+    if not leader:
+        if not flight.done.wait(timeout):
+            return ""
+        return flight.result
+
+    try:
+        # A previous leader may have filled the cache between our miss and now
+        content = _lookup_cached(key, record=False)
+        if content is None:
+            content = _complete(prompt, model, temperature, max_tokens, timeout)
+            if content:
+                _CACHE.put(key, content)
+                if _DISK_CACHE is not None:
+                    try:
+                        _DISK_CACHE.put(key, model, content)
+                    except Exception:
+                        pass
+        flight.result = content
+    finally:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.pop(key, None)
+        flight.done.set()
+    return flight.result
+
+
 def generate_personalized_first_aid(symptoms: List[str], severity: str, vitals: dict) -> List[str]:
     """Return a short list of first-aid suggestions tailored to symptoms and severity.
 
@@ -79,26 +261,53 @@ def explain_recommendations(specialties: List[str], severity: str, drivers: List
     return resp or ""
 
 
-def generate_case_report(case_summary: dict, similar_cases: List[str] = None) -> dict:
+def clinical_basis(case_summary: dict) -> Dict:
+    """The clinical inputs of a case summary, without patient identity.
+
+    Values are passed through as measured; only the name is left out, so
+    patients with the same presentation produce the same case-report prompt
+    (and so share its cached completion).
+    """
+    codes = case_summary.get("symptomCodes") or []
+    return {
+        "symptoms": list(case_summary.get("symptoms") or []),
+        "symptomCodes": sorted(codes),
+        "severity": case_summary.get("severity") or "",
+        "age": case_summary.get("age"),
+        "sex": case_summary.get("sex") or "",
+        "durationHours": case_summary.get("durationHours"),
+        "vitals": {k: v for k, v in (case_summary.get("vitals") or {}).items() if v is not None},
+    }
+
+
+def _deidentify(case_text: str) -> str:
+    # Retrieved case texts are "key:value; ..." records; drop the ones naming a case or patient
+    fields = [f.strip() for f in case_text.split(";")]
+    return "; ".join(f for f in fields if f and f.split(":", 1)[0].strip().lower() not in ("case", "patient"))
+
+
+def generate_case_report(case_summary: dict, similar_cases: List[str] = None, timeout: Optional[float] = None) -> dict:
     """Generate a detailed case report using OpenAI if available.
 
     Returns a dict with keys: summary_text (string) and first_aid (list).
-    Falls back to rule-based report when LLM not available.
+    `first_aid` is empty unless a model answered, so callers fall back to
+    their own rule-based actions when the LLM is unavailable or fails.
     """
     if similar_cases is None:
         similar_cases = []
     if not _HAS_OPENAI:
-        # Build a simple textual summary and reuse generate_personalized_first_aid
-        first_aid = generate_personalized_first_aid(case_summary.get('symptoms', []), case_summary.get('severity', ''), case_summary.get('vitals', {}))
         summary_text = f"Case for {case_summary.get('patientName','Unknown')}: severity={case_summary.get('severity')}. Symptoms: {', '.join(case_summary.get('symptoms',[]))}."
-        return {"summary_text": summary_text, "first_aid": first_aid}
+        return {"summary_text": summary_text, "first_aid": []}
 
-    # Build prompt with similar cases (RAG)
-    sim_text = '\n---\n'.join(similar_cases[:3]) if similar_cases else ''
-    prompt = f"You are a clinical triage assistant.\nProvide a concise structured report for the following case: {case_summary}\n\nSimilar prior cases:\n{sim_text}\n\nReturn a JSON object with keys: summary (short paragraph), firstAid (list of 3 short actions)."
-    resp = _call_chat(prompt, temperature=0.2, max_tokens=500)
+    # Build prompt with similar cases (RAG). Only de-identified inputs go into
+    # the prompt, which is also the cache key: a cached report was generated
+    # from the same measurements and retrieval context, and never carries
+    # another patient's details.
+    basis = clinical_basis(case_summary)
+    sim_text = '\n---\n'.join(_deidentify(c) for c in similar_cases[:3]) if similar_cases else ''
+    prompt = f"You are a clinical triage assistant.\nProvide a concise structured report for the following case: {json.dumps(basis, sort_keys=True)}\n\nSimilar prior cases:\n{sim_text}\n\nReturn a JSON object with keys: summary (short paragraph), firstAid (list of 3 short actions)."
+    resp = _call_chat(prompt, temperature=0.2, max_tokens=500, timeout=timeout)
     # naive parse: try to find JSON in response
-    import json
     try:
         # If the model returned JSON, parse it
         jstart = resp.find('{')
@@ -107,30 +316,8 @@ def generate_case_report(case_summary: dict, similar_cases: List[str] = None) ->
             return {"summary_text": j.get('summary',''), "first_aid": j.get('firstAid', [])}
     except Exception:
         pass
+    if not resp:
+        return {"summary_text": f"Case for {case_summary.get('patientName','Unknown')}", "first_aid": []}
     # fallback to simple parsing
     fa = generate_personalized_first_aid(case_summary.get('symptoms', []), case_summary.get('severity', ''), case_summary.get('vitals', {}))
-    summary_text = resp if resp else f"Case for {case_summary.get('patientName','Unknown')}"
-    return {"summary_text": summary_text, "first_aid": fa}
-"""
-LLM Service Module - Fallback stub for disabled LLM features
-"""
-from typing import Dict, List, Optional
-
-# LLM client disabled - always returns fallback values
-client = None
-
-def generate_medical_report_narrative(report: Dict) -> str:
-    """Fallback - returns standard report format."""
-    return "Standard report format (LLM not available)."
-
-def generate_personalized_first_aid(symptoms: List[str], severity: str, vitals: Dict) -> List[str]:
-    """Fallback - returns empty list for rule-based recommendations."""
-    return []
-
-def clarify_symptoms(vague_symptom: str) -> Dict:
-    """Fallback - returns error message."""
-    return {"error": "LLM service not available"}
-
-def explain_recommendations(specialties: List[str], severity: str, drivers: List[str]) -> str:
-    """Fallback - returns empty string."""
-    return ""
+    return {"summary_text": resp, "first_aid": fa}
@@ -0,0 +1,202 @@
+"""Offline local embeddings with NumPy brute-force top-k.
+
+A hashing vectorizer turns case texts of the form
+"case:1; patient:...; age:55; symptoms:chest pain,fever; vitals:spo2=88,...;
+severity:critical" into fixed-size float32 vectors. It uses symptom phrases
+and words, clinical buckets for age and vitals, and the severity band;
+identifiers such as case id and patient name are ignored. Vectors are
+L2-normalized and kept in one contiguous float32 matrix, so a query is a
+single matrix-vector product plus `argpartition`. No network access and no
+model files are needed.
+
+Run `python local_embeddings.py` for a quick retrieval benchmark.
+"""
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np  # type: ignore
+
+DIM = int(os.environ.get("LOCAL_EMBEDDING_DIM", "256"))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_IGNORED_FIELDS = {"case", "patient"}
+
+
+def _bucket_age(value: float) -> str:
+    return f"{int(value // 10) * 10}s"
+
+
+def _bucket_vital(name: str, value: float) -> str:
+    if name in ("heartRate", "hr"):
+        return "low" if value < 60 else "normal" if value <= 100 else "elevated" if value <= 120 else "high"
+    if name in ("systolicBP", "sbp"):
+        return "low" if value < 90 else "normal" if value < 140 else "high"
+    if name in ("diastolicBP", "dbp"):
+        return "low" if value < 60 else "normal" if value < 90 else "high"
+    if name == "spo2":
+        return "low" if value < 92 else "borderline" if value < 96 else "normal"
+    if name in ("temperatureC", "temp"):
+        return "low" if value < 35 else "normal" if value < 38 else "fever" if value < 39 else "high"
+    return str(round(value))
+
+
+def _number(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def features(text: str) -> List[Tuple[str, float]]:
+    """Return weighted (feature, weight) pairs for a case text."""
+    feats = []
+    for segment in (text or "").split(";"):
+        field, sep, value = segment.partition(":")
+        field, value = field.strip().lower(), value.strip()
+        if not sep:
+            feats.extend((f"w={w}", 0.5) for w in _WORD_RE.findall(segment.lower()))
+            continue
+        if field in _IGNORED_FIELDS or not value or value == "None":
+            continue
+        if field == "age":
+            age = _number(value)
+            if age is not None:
+                feats.append((f"age={_bucket_age(age)}", 1.0))
+        elif field == "vitals":
+            for pair in value.split(","):
+                name, _, raw = pair.partition("=")
+                num = _number(raw)
+                if num is not None:
+                    feats.append((f"{name.strip()}={_bucket_vital(name.strip(), num)}", 1.0))
+        elif field == "severity":
+            feats.append((f"severity={value.lower()}", 1.0))
+        elif field == "symptoms":
+            for phrase in value.lower().split(","):
+                phrase = phrase.strip()
+                if phrase:
+                    feats.append((f"sym={phrase}", 1.5))
+                    feats.extend((f"w={w}", 0.5) for w in _WORD_RE.findall(phrase))
+        else:
+            feats.extend((f"w={w}", 0.5) for w in _WORD_RE.findall(value.lower()))
+    return feats
+
+
+def embed_text_local(text: str, dim: int = DIM) -> np.ndarray:
+    """Signed feature hashing into an L2-normalized float32 vector."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat, weight in features(text):
+        h = zlib.crc32(feat.encode("utf-8"))
+        vec[h % dim] += weight if (h >> 31) & 1 else -weight
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class VectorIndex:
+    """Contiguous float32 matrix of case vectors with brute-force cosine top-k.
+
+    Rows grow by doubling; removing a case moves the last row into its slot
+    so the live rows stay contiguous. When `max_rows` is reached the least
+    recently upserted case is evicted.
+    """
+
+    def __init__(self, dim: int = DIM, max_rows: int = 100000, initial_capacity: int = 1024):
+        self.dim = dim
+        self.max_rows = max_rows
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._rows: "OrderedDict[str, int]" = OrderedDict()  # id -> row, in upsert order
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def upsert(self, case_id: str, text: str, vector: Optional[np.ndarray] = None) -> None:
+        vec = embed_text_local(text, self.dim) if vector is None else vector
+        with self._lock:
+            row = self._rows.pop(case_id, None)
+            if row is None:
+                if len(self._ids) >= self.max_rows:
+                    self._remove_locked(next(iter(self._rows)))
+                row = len(self._ids)
+                if row == self._matrix.shape[0]:
+                    grown = np.zeros((row * 2, self.dim), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._ids.append(case_id)
+                self._texts.append(text)
+            else:
+                self._texts[row] = text
+            self._matrix[row] = vec
+            self._rows[case_id] = row
+
+    def remove(self, case_id: str) -> None:
+        with self._lock:
+            self._remove_locked(case_id)
+
+    def _remove_locked(self, case_id: str) -> None:
+        row = self._rows.pop(case_id, None)
+        if row is None:
+            return
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved
+            self._texts[row] = self._texts[last]
+            self._rows[moved] = row
+        self._ids.pop()
+        self._texts.pop()
+
+    def search_vector(self, vector: np.ndarray, k: int = 3) -> List[Tuple[float, str, str]]:
+        """Return up to `k` (cosine score, case_id, text), best first."""
+        with self._lock:
+            n = len(self._ids)
+            if not n or k <= 0:
+                return []
+            scores = self._matrix[:n] @ vector
+            if n > k:
+                top = np.argpartition(-scores, k)[:k]
+                top = top[np.argsort(-scores[top])]
+            else:
+                top = np.argsort(-scores)
+            return [(float(scores[i]), self._ids[i], self._texts[i]) for i in top if scores[i] > 0]
+
+    def search(self, text: str, k: int = 3) -> List[Tuple[float, str, str]]:
+        return self.search_vector(embed_text_local(text, self.dim), k)
+
+
+def benchmark(n_cases: int = 100000, n_queries: int = 200, k: int = 3) -> Dict[str, float]:
+    """Time index build and query latency over synthetic cases."""
+    import random
+    import time
+    rng = random.Random(0)
+    symptoms = ["chest pain", "shortness of breath", "fever", "cough", "severe headache",
+                "dizziness", "vomiting", "abdominal pain", "rash", "fatigue"]
+
+    def case_text(i: int) -> str:
+        return (f"case:{i}; patient:P{i}; age:{rng.randint(1, 95)}; symptoms:{','.join(rng.sample(symptoms, 2))}; "
+                f"vitals:heartRate={rng.randint(50, 150)},spo2={rng.randint(82, 100)}; "
+                f"severity:{rng.choice(['mild', 'moderate', 'severe', 'critical'])}")
+
+    index = VectorIndex(max_rows=n_cases)
+    t0 = time.perf_counter()
+    for i in range(n_cases):
+        index.upsert(str(i), case_text(i))
+    build = time.perf_counter() - t0
+    queries = [embed_text_local(case_text(-1)) for _ in range(n_queries)]
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search_vector(q, k)
+    query = (time.perf_counter() - t0) / n_queries
+    return {"cases": n_cases, "buildSeconds": round(build, 3), "queryMicros": round(query * 1e6, 1)}
+
+
+if __name__ == "__main__":
+    print(benchmark())
@@ -1,10 +1,18 @@
-from fastapi import FastAPI, Response # type: ignore
+import startup  # first, so start-up timings cover the rest of the imports
+from fastapi import FastAPI, Request, Response # type: ignore
+from fastapi.concurrency import run_in_threadpool  # type: ignore
+from fastapi.responses import StreamingResponse  # type: ignore
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
-from agents import orchestrate_case
-from reportlab.lib.pagesizes import letter  # type: ignore
-from reportlab.pdfgen import canvas  # type: ignore
-import io
-from models import TriageRequest, TriageResponse
+from agents import orchestrate_case_async, orchestrate_rule_case, enrich_case, stream_case_events, clean_output
+from batch_triage import triage_batch
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from case_store import CaseQuery, case_json, case_summary, make_case_store
+from deadline import Deadline
+from fast_json import FastJSONResponse, dumps
+from models import TriageRequest, TriageResponse, BatchTriageRequest, BatchTriageResponse, CaseListResponse
 
 app = FastAPI(title="Multi-Agent Emergency Healthcare Triage (Demo)",
               description="Demo-only triage orchestration. Not medical advice.",
@@ -19,89 +27,287 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-CASES = {}
-CASE_COUNTER = 1
+# Cases live in a pluggable store (SQLite + hot LRU by default, see case_store).
+# Case numbers are allocated by the store, so they stay unique across threads
+# and across worker processes sharing the database (see gunicorn_conf.py).
+CASE_STORE = make_case_store()
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
-@app.post("/api/triage", response_model=TriageResponse)
-def triage(req: TriageRequest):
-    global CASE_COUNTER
-    payload = req.dict()
-    if len(CASES) >= 1000:
-        return {"error": "Case limit reached (1000). No more cases can be created."}
-    payload["case_number"] = CASE_COUNTER
-    result = orchestrate_case(payload)
-    CASES[str(CASE_COUNTER)] = result
-    result["caseId"] = str(CASE_COUNTER)
-    CASE_COUNTER += 1
-    return result
-
-@app.get("/api/case/{case_id}", response_model=TriageResponse)
-def get_case(case_id: str):
-    data = CASES.get(case_id)
-    if not data:
-        return {"caseId": case_id, "createdAt": "", "ledger": [], "final": {}}
+# Readiness: 503 until the start-up warm-up has loaded the deferred modules,
+# so load balancers only route to replicas that will not pay for imports on
+# their first requests. /health stays the liveness check.
+@app.get("/ready")
+def ready():
+    if startup.is_ready():
+        return {"ready": True}
+    return FastJSONResponse({"ready": False}, status_code=503)
+
+@app.get("/health/startup")
+def startup_profile():
+    """Start-up timing breakdown: import and warm-up seconds per module/step."""
+    return startup.stats()
+
+def _next_case_number() -> int:
+    # Reserve the case number before awaiting so concurrent requests never share one
+    return CASE_STORE.allocate_case_number()
+
+# Heavy modules are not imported with this one; warm_up() loads them ahead of
+# the first request (STARTUP_WARMUP=0 skips it and reports ready at once).
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "1").lower() in ("1", "true", "yes")
+WARMUP_MODULES = ["numpy", "pdf_report", "llm_service", "embeddings_service", "scispacy_service", "openai", "chromadb"]
+_pdf_report = startup.lazy("pdf_report")
+
+def _warm_pdf_template():
+    # Render a sample case so ReportLab's fonts and the page template are in place
+    case, _ = orchestrate_rule_case({"case_number": 0, "symptomsText": "chest pain", "vitals": {"spo2": 90}})
+    _pdf_report().render_case_pdf(case)
+
+def warm_up():
+    startup.warm_up(WARMUP_MODULES, [
+        ("spacy model", lambda: startup.load("scispacy_service").load_model()),
+        ("pdf template", _warm_pdf_template),
+        ("triage rules", lambda: triage_batch([{"symptomsText": "chest pain", "vitals": {"spo2": 90}}])),
+    ])
+
+@app.on_event("startup")
+def start_warm_up():
+    if startup.is_ready():  # already warmed in the gunicorn master
+        return
+    if STARTUP_WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        startup.mark_ready()
+
+def preload():
+    """Warm up before worker processes are forked.
+
+    Called by gunicorn_conf.py in the master process: runs the warm-up and
+    freezes the GC so workers share these pages copy-on-write and start ready.
+    """
+    import gc
+    warm_up()
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+# Background enrichment: with enrich=background the rule-based case is stored
+# and returned immediately; a worker later merges the LLM report into the
+# stored case and bumps the case version.
+ENRICH_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("TRIAGE_ENRICH_WORKERS", "4")), thread_name_prefix="triage-enrich")
+CASES_LOCK = threading.Lock()
+
+# With PDF_PRERENDER=1 every stored case version is rendered to the PDF cache
+# in the background, so the first download is served from memory or disk.
+PDF_PRERENDER = os.environ.get("PDF_PRERENDER", "0").lower() in ("1", "true", "yes")
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("PDF_PRERENDER_WORKERS", "1")), thread_name_prefix="pdf-prerender")
+
+def _prerender_pdf(case):
+    try:
+        _pdf_report().case_pdf(case)
+    except Exception as e:
+        print(f"Warning: PDF pre-render failed for case {case.get('caseId')}: {e}")
+
+def _store_case(case_id: str, case) -> bytes:
+    # Serialized once here; the same bytes are stored and served
+    data = case_json(case)
+    CASE_STORE.put(case_id, case, data)
+    # A pending case is about to be replaced by its enriched version
+    if PDF_PRERENDER and case.get("enrichment") != "pending":
+        PDF_EXECUTOR.submit(_prerender_pdf, case)
     return data
 
-# PDF download endpoint
+def _json_bytes(data: bytes) -> Response:
+    return Response(content=data, media_type="application/json")
+
+def _enrich_in_background(case_id: str, steps):
+    try:
+        enriched = enrich_case(case_id, steps)
+        status = "complete"
+    except Exception as e:
+        print(f"Warning: background enrichment failed for case {case_id}: {e}")
+        enriched, status = None, "failed"
+    with CASES_LOCK:
+        current = CASE_STORE.get(case_id)
+        if not current:
+            return
+        merged = dict(enriched or current)
+        merged["caseId"] = case_id
+        merged["createdAt"] = current["createdAt"]
+        merged["version"] = current.get("version", 1) + 1
+        merged["enrichment"] = status
+        _store_case(case_id, merged)
+
+def _split_param(value: Optional[str]):
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+def _project_case(case, include: Optional[str], fields: Optional[str]):
+    """Compact view of a case: the top-level sections named in `include`
+    (e.g. "final,enrichment") plus the dotted paths in `fields`
+    (e.g. "final.priority,final.communityPlan"). caseId is always kept;
+    unknown names are ignored."""
+    out = {"caseId": case.get("caseId")}
+    for path in _split_param(fields):
+        parts = path.split(".")
+        value = case
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = out
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    for section in _split_param(include):
+        if section in case:
+            out[section] = case[section]
+    return out
+
+def _case_response(case, data: bytes, include: Optional[str], fields: Optional[str]):
+    # The full case is served as its stored JSON bytes; a compact view is
+    # encoded on its own. The stored copy (ledger included) is still encoded
+    # once per write by _store_case; only the response leaves the ledger out.
+    if include is None and fields is None:
+        return _json_bytes(data)
+    return FastJSONResponse(_project_case(case, include, fields))
+
+@app.post("/api/triage", response_model=TriageResponse, response_class=FastJSONResponse)
+async def triage(req: TriageRequest, budget_ms: Optional[float] = None, enrich: Optional[str] = None,
+                 include: Optional[str] = None, fields: Optional[str] = None):
+    """Full case by default. `include`/`fields` select a compact response, e.g.
+    `?fields=final.priority,final.communityPlan` for dispatch clients; the
+    ledger is only sent when `include` names it."""
+    payload = req.dict()
+    # Store calls block on SQLite (and on the group commit in shared mode),
+    # so they run in the thread pool rather than on the event loop
+    case_number = await run_in_threadpool(_next_case_number)
+    payload["case_number"] = case_number
+    case_id = str(case_number)
+    if (enrich or os.environ.get("TRIAGE_ENRICH_MODE", "inline")) == "background":
+        result, steps = orchestrate_rule_case(payload)
+        result.update(caseId=case_id, version=1, enrichment="pending")
+        data = await run_in_threadpool(_store_case, case_id, result)
+        ENRICH_EXECUTOR.submit(_enrich_in_background, case_id, steps)
+        return _case_response(result, data, include, fields)
+    # Latency budget starts when the request arrives; None falls back to TRIAGE_BUDGET_MS
+    deadline = Deadline.from_ms(budget_ms) if budget_ms is not None else None
+    result = await orchestrate_case_async(payload, deadline)
+    result.update(caseId=case_id, version=1, enrichment="complete")
+    data = await run_in_threadpool(_store_case, case_id, result)
+    return _case_response(result, data, include, fields)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+@app.post("/api/triage/stream")
+async def triage_stream(req: TriageRequest, budget_ms: Optional[float] = None):
+    """Server-sent events: one event per rule agent as soon as it finishes,
+    then the LLM report and explanation, then `case` with the stored case."""
+    payload = req.dict()
+    deadline = Deadline.from_ms(budget_ms) if budget_ms is not None else None
+    case_number = await run_in_threadpool(_next_case_number)
+    payload["case_number"] = case_number
+
+    async def events():
+        async for step, output in stream_case_events(payload, deadline, explain=True):
+            if step == "case":
+                output.update(caseId=str(case_number), version=1, enrichment="complete")
+                data = await run_in_threadpool(_store_case, str(case_number), output)
+                yield f"event: case\ndata: {data.decode('utf-8')}\n\n"
+            else:
+                yield _sse(step, {"step": step, "output": clean_output(output)})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/triage/batch", response_model=BatchTriageResponse, response_class=FastJSONResponse)
+def triage_batch_endpoint(req: BatchTriageRequest):
+    # Rule-based scoring only; batch results are not stored as cases
+    results = triage_batch([c.dict() for c in req.cases])
+    return {"count": len(results), "results": results}
+
+@app.get("/api/cases", response_model=CaseListResponse, response_class=FastJSONResponse)
+def list_cases(priority: Optional[str] = None, severityBand: Optional[str] = None, specialty: Optional[str] = None,
+               locationHint: Optional[str] = None, createdFrom: Optional[str] = None, createdTo: Optional[str] = None,
+               cursor: Optional[str] = None, limit: int = 50):
+    """Newest cases first. Pass the returned `nextCursor` as `cursor` for the
+    next page; createdFrom/createdTo are ISO-8601 timestamps or dates (UTC
+    unless an offset is given), 422 if they do not parse."""
+    try:
+        query = CaseQuery(priority=priority, severity_band=severityBand, specialty=specialty, location_hint=locationHint,
+                          created_from=createdFrom, created_to=createdTo, cursor=cursor, limit=limit)
+    except ValueError as e:
+        return FastJSONResponse({"detail": str(e)}, status_code=422)
+    cases, next_cursor = CASE_STORE.query(query)
+    return {"count": len(cases), "items": [case_summary(c) for c in cases], "nextCursor": next_cursor}
+
+def _iter_cases(query: CaseQuery):
+    # Walk every page of a listing query
+    while True:
+        cases, cursor = CASE_STORE.query(query)
+        yield from cases
+        if not cursor:
+            return
+        query.before = int(cursor)
+
+@app.get("/api/cases/export")
+def export_cases(createdFrom: Optional[str] = None, createdTo: Optional[str] = None, priority: Optional[str] = None,
+                 severityBand: Optional[str] = None, specialty: Optional[str] = None, locationHint: Optional[str] = None):
+    """ZIP of case PDFs (newest first) for a created-at window, streamed as it is built."""
+    try:
+        query = CaseQuery(priority=priority, severity_band=severityBand, specialty=specialty, location_hint=locationHint,
+                          created_from=createdFrom, created_to=createdTo, limit=500)
+    except ValueError as e:
+        return FastJSONResponse({"detail": str(e)}, status_code=422)
+    return StreamingResponse(_pdf_report().iter_pdf_zip(_iter_cases(query)), media_type="application/zip",
+                             headers={"Content-Disposition": "attachment; filename=triage_cases.zip"})
+
+@app.get("/api/case/{case_id}", response_model=TriageResponse, response_class=FastJSONResponse)
+def get_case(case_id: str, include: Optional[str] = None, fields: Optional[str] = None):
+    """Served from the case's stored JSON bytes, without re-validating or re-encoding."""
+    if include is None and fields is None:
+        data = CASE_STORE.get_json(case_id)
+        if data:
+            return _json_bytes(data)
+    else:
+        case = CASE_STORE.get(case_id)
+        if case:
+            return FastJSONResponse(_project_case(case, include, fields))
+    return {"caseId": case_id, "createdAt": "", "ledger": [], "final": {}}
+
+# PDF download endpoint. PDFs are cached per (case key, version) by pdf_report;
+# the ETag only depends on those, so revalidation never renders.
 @app.get("/api/case/{case_id}/pdf")
-def get_case_pdf(case_id: str):
-    data = CASES.get(case_id)
+def get_case_pdf(case_id: str, request: Request):
+    data = CASE_STORE.get(case_id)
     if not data:
         return Response(content="Case not found", status_code=404)
-    report = data["final"]["report"]
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    y = 750
-    p.setFont("Helvetica-Bold", 14)
-    p.drawString(50, y, "EMERGENCY HEALTHCARE TRIAGE REPORT")
-    y -= 30
-    p.setFont("Helvetica", 10)
-    p.drawString(50, y, f"Patient Name: {report['summary'].get('patientName','-')}")
-    y -= 15
-    p.drawString(50, y, f"Case ID: {report.get('caseId','-')}")
-    y -= 15
-    p.drawString(50, y, f"Generated: {report.get('generatedAt','-')}")
-    y -= 25
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, y, "Patient Information")
-    y -= 18
-    p.setFont("Helvetica", 10)
-    p.drawString(50, y, f"Age: {report['summary'].get('age','-')}")
-    p.drawString(200, y, f"Sex: {report['summary'].get('sex','-')}")
-    y -= 15
-    p.drawString(50, y, f"Symptoms: {', '.join(report['summary'].get('symptoms',[]))}")
-    y -= 15
-    p.drawString(50, y, f"Duration: {report['summary'].get('durationHours','-')} hours")
-    y -= 20
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, y, "Triage Assessment")
-    y -= 18
-    p.setFont("Helvetica", 10)
-    triage = report.get('triage',{})
-    p.drawString(50, y, f"Risk Score: {triage.get('riskScore','-')}")
-    p.drawString(200, y, f"Risk Tier: {triage.get('riskTier','-')}")
-    y -= 15
-    p.drawString(50, y, f"Severity Band: {triage.get('severityBand','-')}")
-    p.drawString(200, y, f"Priority: {triage.get('emergencyPriority','-')}")
-    y -= 20
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, y, "First Aid Recommendations")
-    y -= 18
-    p.setFont("Helvetica", 10)
-    for fa in report.get('recommendations',{}).get('firstAid',[]):
-        p.drawString(60, y, f"- {fa}")
-        y -= 13
-        if y < 60:
-            p.showPage()
-            y = 750
-    y -= 10
-    p.setFont("Helvetica", 8)
-    p.drawString(50, y, "Disclaimer: Informational triage demo; not medical diagnosis or treatment.")
-    p.save()
-    buffer.seek(0)
-    return Response(content=buffer.read(), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=triage_case_{case_id}.pdf"})
+    version = data.get("version", 1)
+    etag = _pdf_report().case_etag(data)
+    headers = {"ETag": etag, "X-Case-Version": str(version), "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f"attachment; filename=triage_case_{case_id}.pdf"
+    return Response(content=_pdf_report().case_pdf(data), media_type="application/pdf", headers=headers)
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    # Background enrichment writes new case versions, so it has to finish
+    # before the store (and its writer thread) is closed
+    ENRICH_EXECUTOR.shutdown(wait=True)
+    PDF_EXECUTOR.shutdown(wait=False)
+    pdf_report = startup.loaded("pdf_report")
+    if pdf_report is not None:
+        pdf_report.shutdown_export_pool()
+    CASE_STORE.close()
+    embeddings_service = startup.loaded("embeddings_service")
+    if embeddings_service is not None:
+        try:
+            embeddings_service.close_writes()
+        except Exception:
+            pass
 
+startup.imported("main")
@@ -26,4 +26,18 @@ class TriageResponse(BaseModel):
     caseId: str
     createdAt: str
     ledger: List[dict]
-    final: dict
\ No newline at end of file
+    final: dict
+    version: int = 1
+    enrichment: Optional[str] = None
+
+class BatchTriageRequest(BaseModel):
+    cases: List[TriageRequest]
+
+class BatchTriageResponse(BaseModel):
+    count: int
+    results: List[dict]
+
+class CaseListResponse(BaseModel):
+    count: int
+    items: List[dict]
+    nextCursor: Optional[str] = None
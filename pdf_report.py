@@ -0,0 +1,564 @@
+"""PDF rendering of triage case reports, with a cache of rendered bytes.
+
+`render_case_pdf(case)` draws the report with ReportLab. The static page
+furniture (title, labels, section headers, footer disclaimer) is laid out
+once at import: its PDF operators are captured from a scratch canvas and
+spliced into each page, so per case only the field values are drawn, in one
+text object per page. The splice and the ASCII85-free page streams rely on
+private ReportLab canvas internals (`_code`, `_doc`); when those are missing
+the furniture is drawn on every page and streams keep the default encoding.
+First-aid items wrap to the page width and continue on further pages. Run `python pdf_report.py` to
+compare it with the previous per-string renderer. `case_pdf(case)`
+serves it through `PdfCache`, keyed by (`case_key(case)`, case version) so
+an enriched case (new version) is re-rendered while repeat downloads are not.
+Case numbers restart when a store is reset or replaced, so the key also
+carries a digest of the case's creation time: a new case 1 never matches a
+PDF (or ETag) cached for an earlier one.
+The cache is an in-memory LRU bounded by PDF_CACHE_MAX_MB. With
+PDF_CACHE_DIR set, PDFs are also written to that directory, which can be
+shared by worker processes and is bounded by PDF_CACHE_DIR_MAX_MB.
+
+`case_etag(case)` depends only on the case key, version and `PDF_LAYOUT`,
+so it is stable across re-renders, restarts and workers.
+
+`iter_pdf_zip(cases)` streams a ZIP of many case PDFs. Rendering is
+CPU-bound and holds the GIL, so uncached PDFs are rendered in a process pool
+(PDF_EXPORT_WORKERS, default: CPU count; 0 renders inline) with a bounded
+number in flight, and ZIP bytes are yielded as each entry is written.
+"""
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from reportlab import rl_config  # type: ignore
+from reportlab.lib.pagesizes import letter  # type: ignore
+from reportlab.lib.utils import simpleSplit  # type: ignore
+from reportlab.pdfbase.pdfdoc import PDFStream, PDFZCompress  # type: ignore
+from reportlab.pdfbase.pdfmetrics import stringWidth  # type: ignore
+from reportlab.pdfgen import canvas  # type: ignore
+
+# Bump whenever the rendered layout changes; invalidates ETags and cache files
+PDF_LAYOUT = "2"
+
+_FONT, _BOLD = "Helvetica", "Helvetica-Bold"
+_LEFT, _RIGHT, _TOP, _BOTTOM, _FOOTER_Y = 50, letter[0] - 50, 750, 60, 40
+_LINE = 13
+_BULLET = "- "
+_DISCLAIMER = "Disclaimer: Informational triage demo; not medical diagnosis or treatment."
+
+# Page 1 labels: (field, label, x, y); the value is drawn right after the label
+_LABELS = [
+    ("patientName", "Patient Name: ", 50, 720),
+    ("caseId", "Case ID: ", 50, 705),
+    ("generatedAt", "Generated: ", 50, 690),
+    ("age", "Age: ", 50, 647),
+    ("sex", "Sex: ", 200, 647),
+    ("symptoms", "Symptoms: ", 50, 632),
+    ("durationHours", "Duration: ", 50, 617),
+    ("riskScore", "Risk Score: ", 50, 579),
+    ("riskTier", "Risk Tier: ", 200, 579),
+    ("severityBand", "Severity Band: ", 50, 564),
+    ("emergencyPriority", "Priority: ", 200, 564),
+]
+_HEADERS = [("Patient Information", 665), ("Triage Assessment", 597), ("First Aid Recommendations", 544)]
+_FIELD_X = {field: x + stringWidth(label, _FONT, 10) for field, label, x, _ in _LABELS}
+_FIELD_Y = {field: y for field, _, _, y in _LABELS}
+_FIRST_AID_TOP = {"first": 526, "next": _TOP - 18}
+_BULLET_WIDTH = stringWidth(_BULLET, _FONT, 10)
+
+
+def _draw_furniture(p, page: str) -> None:
+    if page == "first":
+        p.setFont(_BOLD, 14)
+        p.drawString(_LEFT, _TOP, "EMERGENCY HEALTHCARE TRIAGE REPORT")
+        p.setFont(_FONT, 10)
+        for _, label, x, y in _LABELS:
+            p.drawString(x, y, label)
+        p.setFont(_BOLD, 12)
+        for header, y in _HEADERS:
+            p.drawString(_LEFT, y, header)
+    else:
+        p.setFont(_BOLD, 12)
+        p.drawString(_LEFT, _TOP, "First Aid Recommendations (continued)")
+    p.setFont(_FONT, 8)
+    p.drawString(_LEFT, _FOOTER_Y, _DISCLAIMER)
+
+
+def _capture_furniture():
+    """Page operators for each furniture template, recorded once from a scratch canvas.
+
+    Returns None if this ReportLab version does not expose the canvas
+    internals used here; the furniture is then drawn on every page instead.
+    A per-document form XObject would also avoid redrawing, but its extra
+    objects cost more than they save on one- or two-page reports.
+    """
+    try:
+        code = {}
+        for page in ("first", "next"):
+            scratch = canvas.Canvas(io.BytesIO(), pagesize=letter)
+            fonts = {name: scratch._doc.getInternalFontName(name) for name in (_FONT, _BOLD)}
+            _draw_furniture(scratch, page)
+            code[page] = list(scratch._code)
+        return fonts, code
+    except Exception:
+        return None
+
+
+_FURNITURE = _capture_furniture()
+
+
+def _furniture(p) -> Optional[Dict]:
+    # Captured templates, if this document names its fonts like the scratch canvas did
+    if _FURNITURE is None:
+        return None
+    fonts, code = _FURNITURE
+    return code if {n: p._doc.getInternalFontName(n) for n in (_FONT, _BOLD)} == fonts else None
+
+
+def _without_a85(p) -> None:
+    """Compress this canvas's page streams without the ASCII85 wrapper.
+
+    PDFs are only served over HTTP or zipped, so ASCII85 only costs CPU (pure
+    Python) and ~25% output size. `rl_config.useA85` would change it for every
+    ReportLab document in the process, so instead each page's content stream
+    is built as it is closed, the way `PDFPage.check_format` would build it
+    minus ASCII85. Relies on canvas internals; without them the page keeps
+    ReportLab's default encoding.
+    """
+    def on_page(_number):
+        try:
+            page = p._doc.Pages.pages[-1]
+        except (AttributeError, IndexError):
+            return
+        if page.compression and not page.Contents and page.stream:
+            stream = PDFStream(content=page.stream, filters=[PDFZCompress])
+            stream.__Comment__ = "page stream"
+            page.Contents = stream
+    p.setPageCallBack(on_page)
+
+
+def _start_page(p, page: str, templates: Optional[Dict]):
+    if templates is not None:
+        p._code.extend(templates[page])
+    else:
+        _draw_furniture(p, page)
+    text = p.beginText()
+    text.setFont(_FONT, 10)
+    return text
+
+
+def _fit_symptoms(symptoms, width: float) -> str:
+    # One line; symptoms that do not fit are summarized as "+N more"
+    text = ""
+    for i, symptom in enumerate(symptoms):
+        candidate = f"{text}, {symptom}" if text else symptom
+        more = f" (+{len(symptoms) - i - 1} more)" if i < len(symptoms) - 1 else ""
+        if text and stringWidth(candidate + more, _FONT, 10) > width:
+            return f"{text} (+{len(symptoms) - i} more)"
+        text = candidate
+    return text
+
+
+@functools.lru_cache(maxsize=1024)
+def _wrap_first_aid(item: str) -> Tuple[str, ...]:
+    # First-aid texts repeat across cases (rule-based advice), so wrapping is memoized
+    return tuple(simpleSplit(item, _FONT, 10, _RIGHT - 60 - _BULLET_WIDTH)) or ("",)
+
+
+def render_case_pdf(case: Dict) -> bytes:
+    report = case["final"]["report"]
+    summary = report.get("summary", {})
+    triage = report.get("triage", {})
+    values = {
+        "patientName": summary.get("patientName", "-"),
+        "caseId": report.get("caseId", "-"),
+        "generatedAt": report.get("generatedAt", "-"),
+        "age": summary.get("age", "-"),
+        "sex": summary.get("sex", "-"),
+        "symptoms": _fit_symptoms(summary.get("symptoms", []), _RIGHT - _FIELD_X["symptoms"]),
+        "durationHours": f"{summary.get('durationHours', '-')} hours",
+        "riskScore": triage.get("riskScore", "-"),
+        "riskTier": triage.get("riskTier", "-"),
+        "severityBand": triage.get("severityBand", "-"),
+        "emergencyPriority": triage.get("emergencyPriority", "-"),
+    }
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter)
+    _without_a85(p)
+    templates = _furniture(p)
+    text = _start_page(p, "first", templates)
+    for field, value in values.items():
+        text.setTextOrigin(_FIELD_X[field], _FIELD_Y[field])
+        text.textLine(str(value))
+    y = _FIRST_AID_TOP["first"]
+    for item in report.get("recommendations", {}).get("firstAid", []):
+        lines = _wrap_first_aid(str(item))
+        for i, line in enumerate(lines):
+            if y < _BOTTOM:
+                p.drawText(text)
+                p.showPage()
+                text = _start_page(p, "next", templates)
+                y = _FIRST_AID_TOP["next"]
+            if i == 0:
+                text.setTextOrigin(60, y)
+                text.textLine(_BULLET + line)
+            else:
+                text.setTextOrigin(60 + _BULLET_WIDTH, y)
+                text.textLine(line)
+            y -= _LINE
+    p.drawText(text)
+    p.save()
+    return buffer.getvalue()
+
+
+def _render_case_pdf_legacy(case: Dict) -> bytes:
+    """The previous renderer (one drawString per label and value), kept for `benchmark()`."""
+    report = case["final"]["report"]
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=letter)
+    y = 750
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(50, y, "EMERGENCY HEALTHCARE TRIAGE REPORT")
+    y -= 30
+    p.setFont("Helvetica", 10)
+    p.drawString(50, y, f"Patient Name: {report['summary'].get('patientName','-')}")
+    y -= 15
+    p.drawString(50, y, f"Case ID: {report.get('caseId','-')}")
+    y -= 15
+    p.drawString(50, y, f"Generated: {report.get('generatedAt','-')}")
+    y -= 25
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "Patient Information")
+    y -= 18
+    p.setFont("Helvetica", 10)
+    p.drawString(50, y, f"Age: {report['summary'].get('age','-')}")
+    p.drawString(200, y, f"Sex: {report['summary'].get('sex','-')}")
+    y -= 15
+    p.drawString(50, y, f"Symptoms: {', '.join(report['summary'].get('symptoms',[]))}")
+    y -= 15
+    p.drawString(50, y, f"Duration: {report['summary'].get('durationHours','-')} hours")
+    y -= 20
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "Triage Assessment")
+    y -= 18
+    p.setFont("Helvetica", 10)
+    triage = report.get('triage',{})
+    p.drawString(50, y, f"Risk Score: {triage.get('riskScore','-')}")
+    p.drawString(200, y, f"Risk Tier: {triage.get('riskTier','-')}")
+    y -= 15
+    p.drawString(50, y, f"Severity Band: {triage.get('severityBand','-')}")
+    p.drawString(200, y, f"Priority: {triage.get('emergencyPriority','-')}")
+    y -= 20
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "First Aid Recommendations")
+    y -= 18
+    p.setFont("Helvetica", 10)
+    for fa in report.get('recommendations',{}).get('firstAid',[]):
+        p.drawString(60, y, f"- {fa}")
+        y -= 13
+        if y < 60:
+            p.showPage()
+            y = 750
+    y -= 10
+    p.setFont("Helvetica", 8)
+    p.drawString(50, y, "Disclaimer: Informational triage demo; not medical diagnosis or treatment.")
+    p.save()
+    return buffer.getvalue()
+
+
+def case_key(case: Dict) -> str:
+    """Case id plus a digest of its creation time, unique across store lifetimes."""
+    case_id = case.get("caseId")
+    digest = hashlib.sha1(f"{case_id}|{case.get('createdAt', '')}".encode("utf-8")).hexdigest()[:12]
+    return f"{case_id}-{digest}"
+
+
+def case_etag(case: Dict) -> str:
+    return f'"case-{case_key(case)}-v{int(case.get("version", 1))}-l{PDF_LAYOUT}"'
+
+
+class PdfCache:
+    """LRU of rendered PDFs bounded by total bytes, optionally backed by a directory.
+
+    Only the latest version of a case is kept: storing version N drops the
+    older versions from memory and disk.
+    """
+
+    # Disk eviction lists the directory, so it only runs every few writes
+    EVICT_EVERY = 16
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()  # (case key, version) -> PDF
+        self._versions: Dict[str, int] = {}  # case key -> cached version
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, version: int) -> str:
+        return os.path.join(self.directory, f"case_{key}_v{version}_l{PDF_LAYOUT}.pdf")
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        entry = (key, version)
+        with self._lock:
+            pdf = self._entries.get(entry)
+            if pdf is not None:
+                self._entries.move_to_end(entry)
+                self.hits += 1
+                return pdf
+        if self.directory:
+            path = self._path(key, version)
+            try:
+                with open(path, "rb") as f:
+                    pdf = f.read()
+                os.utime(path)  # mark recently used for disk eviction
+            except OSError:
+                pdf = None
+            if pdf is not None:
+                self.disk_hits += 1
+                self._remember(key, version, pdf)
+                return pdf
+        self.misses += 1
+        return None
+
+    def _remember(self, key: str, version: int, pdf: bytes) -> None:
+        with self._lock:
+            old = self._versions.get(key)
+            if old is not None and old > version:
+                return
+            if old is not None:
+                self._bytes -= len(self._entries.pop((key, old), b""))
+            self._entries[(key, version)] = pdf
+            self._versions[key] = version
+            self._bytes += len(pdf)
+            while self._bytes > self.max_bytes and self._entries:
+                (evicted_id, _), evicted = self._entries.popitem(last=False)
+                self._versions.pop(evicted_id, None)
+                self._bytes -= len(evicted)
+
+    def put(self, key: str, version: int, pdf: bytes) -> None:
+        self._remember(key, version, pdf)
+        if not self.directory:
+            return
+        try:
+            path = self._path(key, version)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp, path)
+            for older in range(1, version):
+                try:
+                    os.remove(self._path(key, older))
+                except OSError:
+                    pass
+            self._disk_writes += 1
+            if self._disk_writes % self.EVICT_EVERY == 0:
+                self._evict_disk()
+        except OSError as e:
+            print(f"Warning: PDF cache write failed for case {key}: {e}")
+
+    def _evict_disk(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "maxBytes": self.max_bytes,
+                    "hits": self.hits, "diskHits": self.disk_hits, "misses": self.misses,
+                    "directory": self.directory}
+
+
+PDF_CACHE = PdfCache(
+    max_bytes=int(float(os.environ.get("PDF_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    directory=os.environ.get("PDF_CACHE_DIR") or None,
+    max_disk_bytes=int(float(os.environ.get("PDF_CACHE_DIR_MAX_MB", "512")) * 1024 * 1024),
+)
+
+
+def case_pdf(case: Dict) -> bytes:
+    """Rendered PDF for the stored case, from the cache when possible."""
+    key, version = case_key(case), int(case.get("version", 1))
+    pdf = PDF_CACHE.get(key, version)
+    if pdf is None:
+        pdf = render_case_pdf(case)
+        PDF_CACHE.put(key, version, pdf)
+    return pdf
+
+
+_EXPORT_WORKERS = int(os.environ.get("PDF_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+_EXPORT_POOL: Optional[ProcessPoolExecutor] = None
+_EXPORT_POOL_LOCK = threading.Lock()
+
+
+def _export_pool() -> Optional[ProcessPoolExecutor]:
+    global _EXPORT_POOL
+    if _EXPORT_WORKERS <= 0:
+        return None
+    with _EXPORT_POOL_LOCK:
+        if _EXPORT_POOL is None:
+            # spawn: workers only import this module, and never inherit the
+            # server's threads, sockets or database connections
+            _EXPORT_POOL = ProcessPoolExecutor(max_workers=_EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _EXPORT_POOL
+
+
+def _replace_export_pool(broken: ProcessPoolExecutor) -> Optional[ProcessPoolExecutor]:
+    """Drop a pool whose worker died (killed, out of memory) and return a fresh one."""
+    global _EXPORT_POOL
+    with _EXPORT_POOL_LOCK:
+        if _EXPORT_POOL is broken:
+            _EXPORT_POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
+    return _export_pool()
+
+
+def shutdown_export_pool() -> None:
+    global _EXPORT_POOL
+    with _EXPORT_POOL_LOCK:
+        if _EXPORT_POOL is not None:
+            _EXPORT_POOL.shutdown(wait=False, cancel_futures=True)
+            _EXPORT_POOL = None
+
+
+class _ZipChunks(io.RawIOBase):
+    """Unseekable sink for ZipFile; `take()` returns what was written since the last call."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_pdf_zip(cases: Iterable[Dict]) -> Iterator[bytes]:
+    """Yield a ZIP archive with one `triage_case_<id>.pdf` per case, in input order.
+
+    If a pool worker dies, the pool is replaced and the affected cases are
+    submitted once more.
+    """
+    pool = _export_pool()
+    window = max(2, 4 * _EXPORT_WORKERS)
+    pending: deque = deque()  # (case, PDF bytes or future, pool it was submitted to)
+    sink = _ZipChunks()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+
+        def submit(case, retry: bool = True):
+            nonlocal pool
+            submitted_to = pool
+            try:
+                return pool.submit(render_case_pdf, case), submitted_to
+            except BrokenProcessPool:
+                if not retry:
+                    raise
+                pool = _replace_export_pool(submitted_to)
+                return submit(case, retry=False)
+
+        def write_oldest():
+            nonlocal pool
+            case, pdf, submitted_to = pending.popleft()
+            if not isinstance(pdf, bytes):
+                try:
+                    pdf = pdf.result()
+                except BrokenProcessPool:
+                    if pool is submitted_to:
+                        pool = _replace_export_pool(submitted_to)
+                    pdf = submit(case, retry=False)[0].result()
+            archive.writestr(f"triage_case_{case.get('caseId')}.pdf", pdf)
+            return sink.take()
+
+        for case in cases:
+            pdf = PDF_CACHE.get(case_key(case), int(case.get("version", 1)))
+            submitted_to = None
+            if pdf is None:
+                if pool is not None:
+                    pdf, submitted_to = submit(case)
+                else:
+                    pdf = render_case_pdf(case)
+            pending.append((case, pdf, submitted_to))
+            if len(pending) >= window:
+                yield write_oldest()
+        while pending:
+            yield write_oldest()
+    yield sink.take()
+
+
+def benchmark(n_cases: int = 300, first_aid_items: int = 4, item_words: int = 10) -> Dict[str, Dict[str, float]]:
+    """Per-PDF render time and size of the legacy and template renderers."""
+    import time
+    advice = "Keep the person calm and seated. Call emergency services immediately, stay with them until help arrives."
+    first_aid = [" ".join((advice.split() * 8)[:item_words])] * first_aid_items
+    case = {"caseId": "1", "version": 1, "final": {"report": {
+        "caseId": "1", "generatedAt": "2026-01-01T00:00:00Z",
+        "summary": {"patientName": "Test Patient", "age": 55, "sex": "female",
+                    "symptoms": ["chest pain", "shortness of breath", "dizziness"], "durationHours": 2},
+        "triage": {"riskScore": 7, "riskTier": "High", "severityBand": "critical", "emergencyPriority": "P1"},
+        "recommendations": {"firstAid": first_aid}}}}
+
+    def measure(render, a85: Optional[int] = None) -> Dict[str, float]:
+        # `a85` overrides rl_config.useA85 for the legacy renderer, which has no per-canvas setting
+        saved = rl_config.useA85
+        if a85 is not None:
+            rl_config.useA85 = a85
+        try:
+            render(case)
+            t0 = time.perf_counter()
+            for _ in range(n_cases):
+                pdf = render(case)
+            return {"msPerPdf": round((time.perf_counter() - t0) * 1000 / n_cases, 3), "bytes": len(pdf)}
+        finally:
+            rl_config.useA85 = saved
+
+    return {
+        "legacy": measure(_render_case_pdf_legacy, 1),
+        "legacyNoA85": measure(_render_case_pdf_legacy, 0),
+        "template": measure(render_case_pdf),
+    }
+
+
+__all__ = ["PDF_LAYOUT", "render_case_pdf", "case_key", "case_etag", "PdfCache", "PDF_CACHE", "case_pdf",
+           "iter_pdf_zip", "shutdown_export_pool"]
+
+
+if __name__ == "__main__":
+    for items, words in ((4, 10), (60, 10), (4, 40)):
+        print(f"{items} first-aid items of {words} words:", benchmark(first_aid_items=items, item_words=words))
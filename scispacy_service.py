@@ -2,37 +2,50 @@
 
 Provides `extract_entities(text)` returning list of entity strings.
 If scispacy/spacy are unavailable, falls back to simple symptom tokenization.
+spaCy and its model are loaded on first use, or ahead of time by `load_model()`.
 """
 from typing import List
 import re
+import threading
 
-_HAS_SPACY = False
-try:
-    import spacy  # type: ignore
-    # scispacy models are heavy; user must install separately (e.g., en_core_sci_sm)
-    _HAS_SPACY = True
-except Exception:
-    _HAS_SPACY = False
+import startup
+
+# scispacy models are heavy; user must install separately (e.g., en_core_sci_sm)
+_HAS_SPACY = startup.available("spacy")
 
 _nlp = None
-if _HAS_SPACY:
-    try:
-        # prefer sci model if present
-        try:
-            _nlp = spacy.load("en_core_sci_sm")
-        except Exception:
-            _nlp = spacy.load("en_core_web_sm")
-    except Exception:
-        _nlp = None
-        _HAS_SPACY = False
+_nlp_lock = threading.Lock()
+_load_attempted = False
+
+
+def load_model():
+    """Load the spaCy model once (sci model preferred); None when unavailable."""
+    global _nlp, _HAS_SPACY, _load_attempted
+    if _load_attempted or not _HAS_SPACY:
+        return _nlp
+    with _nlp_lock:
+        if not _load_attempted:
+            try:
+                spacy = startup.load("spacy")
+                # prefer sci model if present
+                try:
+                    _nlp = spacy.load("en_core_sci_sm")
+                except Exception:
+                    _nlp = spacy.load("en_core_web_sm")
+            except Exception:
+                _nlp = None
+                _HAS_SPACY = False
+            _load_attempted = True
+    return _nlp
 
 
 def extract_entities(text: str) -> List[str]:
     """Return extracted entities or tokens approximating symptoms."""
     if not text:
         return []
-    if _HAS_SPACY and _nlp:
-        doc = _nlp(text)
+    nlp = load_model()
+    if nlp:
+        doc = nlp(text)
         ents = [ent.text for ent in doc.ents]
         if ents:
             return ents
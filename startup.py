@@ -0,0 +1,137 @@
+"""Deferred imports, start-up warm-up and readiness.
+
+Heavy dependencies (NumPy, ReportLab, the OpenAI client, chromadb, spaCy
+and its model) are not imported with `main`. Modules that need them call
+`load(name)`, or keep the accessor returned by `lazy(name)`, which imports
+the module on first use and records how long the import took.
+
+`warm_up(modules, tasks)` imports those modules and runs the warm-up tasks
+(loading the spaCy model, say) ahead of the first request, then marks the
+process ready. `main` runs it in a background thread at start-up, or in the
+gunicorn master before forking, and GET /ready reports 503 until it has
+finished. `stats()` is the start-up timing breakdown per module and step.
+For a full import profile, run `python -X importtime -c "import main"`.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+_STARTED = time.perf_counter()  # `main` imports this module first
+
+_lock = threading.Lock()
+_import_seconds: Dict[str, float] = {}
+_step_seconds: Dict[str, float] = {}
+_failed: Dict[str, str] = {}
+_ready = threading.Event()
+_ready_after: Optional[float] = None
+
+
+def available(name: str) -> bool:
+    """Whether `name` is installed, without importing it."""
+    if name in sys.modules:
+        return True
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _initializing(module) -> bool:
+    spec = getattr(module, "__spec__", None)
+    return bool(getattr(spec, "_initializing", False))
+
+
+def load(name: str):
+    """Import a module on first use and record how long the import took.
+
+    A module another thread (the warm-up, say) is still importing is in
+    `sys.modules` half-initialized; `import_module` then waits on its
+    import lock until it is complete.
+    """
+    module = sys.modules.get(name)
+    if module is not None and not _initializing(module):
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _import_seconds.setdefault(name, time.perf_counter() - started)
+    return module
+
+
+def lazy(name: str) -> Callable:
+    """Accessor that imports `name` on its first call and then returns the cached module."""
+    module = None
+
+    def get():
+        nonlocal module
+        if module is None:
+            module = load(name)
+        return module
+    return get
+
+
+def loaded(name: str):
+    """The module if it has been imported already, else None."""
+    return sys.modules.get(name)
+
+
+def imported(name: str) -> None:
+    """Record the time from process start-up until `name` finished importing."""
+    with _lock:
+        _import_seconds[name] = time.perf_counter() - _STARTED
+
+
+def warm_up(modules: Iterable[str], tasks: Iterable[Tuple[str, Callable]] = ()) -> None:
+    """Import the installed `modules`, run the (name, fn) `tasks`, then mark the process ready.
+
+    Failures are reported and skipped: the request path falls back the same
+    way it would without warm-up.
+    """
+    for name in modules:
+        if not available(name):
+            continue
+        try:
+            load(name)
+        except Exception as e:
+            _failed[name] = str(e)
+            print(f"Warning: warm-up import of {name} failed: {e}")
+    for name, fn in tasks:
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            _failed[name] = str(e)
+            print(f"Warning: warm-up step {name} failed: {e}")
+        with _lock:
+            _step_seconds[name] = time.perf_counter() - started
+    mark_ready()
+
+
+def mark_ready() -> None:
+    global _ready_after
+    if not _ready.is_set():
+        _ready_after = time.perf_counter() - _STARTED
+        _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def stats() -> dict:
+    def rounded(d):
+        return {k: round(v, 4) for k, v in sorted(d.items(), key=lambda kv: -kv[1])}
+    with _lock:
+        return {
+            "ready": _ready.is_set(),
+            "readySeconds": None if _ready_after is None else round(_ready_after, 4),
+            "importSeconds": rounded(_import_seconds),
+            "warmupSeconds": rounded(_step_seconds),
+            "failed": dict(_failed),
+        }
+
+
+__all__ = ["available", "load", "lazy", "loaded", "imported", "warm_up", "mark_ready", "is_ready", "stats"]
@@ -0,0 +1,174 @@
+"""Canonical symptom codes from free-text symptoms.
+
+A synonym dictionary maps each canonical code (e.g. "dyspnea") to the
+phrasings that mean it ("shortness of breath", "SOB", "can't breathe").
+All phrases are compiled into one word-level Aho-Corasick automaton, so a
+case's symptom text is scanned once and the cost grows with the text length,
+not with the number of phrases. Overlapping matches resolve leftmost-longest
+("severe headache" wins over "headache"). Phrases never span a comma,
+semicolon or full stop. A match is dropped when it starts within a few words
+after a negation cue ("no chest pain", "denies any fever"); the negation
+scope also ends at a conjunction or preposition such as "and", "with" or
+"but", so "no appetite and chest pain" still reports chest pain.
+
+`match_codes(text)` returns the codes in order of first mention. The intake
+agent runs it once per case; the other agents only look at the codes.
+"""
+import re
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_SYNONYMS: Dict[str, List[str]] = {
+    "chest_pain": ["chest pain", "chest pains", "chest tightness", "tight chest", "chest pressure",
+                   "pressure in chest", "pressure in my chest", "pain in chest", "pain in the chest",
+                   "pain in my chest", "angina", "cardiac pain"],
+    "dyspnea": ["shortness of breath", "short of breath", "sob", "dyspnea", "dyspnoea", "difficulty breathing",
+                "trouble breathing", "breathing difficulty", "breathlessness", "breathless", "cannot breathe",
+                "can t breathe", "hard to breathe", "labored breathing", "laboured breathing"],
+    "severe_headache": ["severe headache", "worst headache", "thunderclap headache", "excruciating headache",
+                        "sudden severe headache"],
+    "headache": ["headache", "head ache", "migraine"],
+    "fever": ["fever", "febrile", "feverish", "pyrexia", "high temperature"],
+    "cough": ["cough", "coughing"],
+    "dizziness": ["dizziness", "dizzy", "lightheaded", "light headed", "lightheadedness", "vertigo"],
+    "abdominal_pain": ["abdominal pain", "stomach pain", "belly pain", "stomach ache", "stomachache",
+                       "tummy pain", "abdominal cramps"],
+    "vomiting": ["vomiting", "vomit", "vomited", "throwing up", "emesis"],
+    "nausea": ["nausea", "nauseous", "nauseated"],
+    "syncope": ["syncope", "fainting", "fainted", "passed out", "loss of consciousness"],
+}
+
+NEGATION_CUES = ("no", "not", "denies", "denied", "without", "negative")
+# NegEx-style scope: a cue negates at most the next _NEGATION_WINDOW words,
+# and a terminator word or punctuation ends the scope early
+_NEGATION_WINDOW = 5
+_NEGATION_TERMINATORS = frozenset(("and", "with", "but", "however", "although", "though", "yet", "except",
+                                   "plus", "also", "reports", "complains", "presents"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[,;.\n]")
+_DOTTED_ABBREV_RE = re.compile(r"\b([a-z])\.(?=[a-z]\b)")  # "s.o.b." -> "sob."
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(_DOTTED_ABBREV_RE.sub(r"\1", (text or "").lower()))
+
+
+class SymptomMatcher:
+    """Word-level Aho-Corasick automaton over a synonym dictionary."""
+
+    def __init__(self, synonyms: Dict[str, Sequence[str]], negation_cues: Sequence[str] = NEGATION_CUES):
+        self.synonyms = synonyms
+        self.negation_cues = frozenset(negation_cues)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, str]]] = [[]]  # (phrase length in words, code)
+        for code, phrases in synonyms.items():
+            for phrase in phrases:
+                words = _tokens(phrase)
+                if words:
+                    self._add(words, code)
+        self._link()
+
+    def _add(self, words: List[str], code: str) -> None:
+        state = 0
+        for word in words:
+            nxt = self._goto[state].get(word)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][word] = nxt
+            state = nxt
+        self._out[state].append((len(words), code))
+
+    def _link(self) -> None:
+        # Breadth-first failure links; each state inherits its fallback's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(word, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[Tuple[int, int, str, bool]]:
+        """Non-overlapping (start, end, code, negated) matches over the word tokens."""
+        tokens = _tokens(text)
+        found = []
+        state = 0
+        for end, token in enumerate(tokens, 1):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for length, code in self._out[state]:
+                found.append((end - length, end, code))
+        # Leftmost-longest, non-overlapping
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        matches = []
+        covered = 0
+        cue_at = self._negation_positions(tokens)
+        for start, end, code in found:
+            if start < covered:
+                continue
+            covered = end
+            matches.append((start, end, code, cue_at[start]))
+        return matches
+
+    def _negation_positions(self, tokens: List[str]) -> List[bool]:
+        # negated[i]: token i falls inside the scope of an earlier negation cue
+        negated = []
+        remaining = 0  # words left in the current negation scope
+        for token in tokens:
+            if token in (",", ";", ".", "\n") or token in _NEGATION_TERMINATORS:
+                remaining = 0
+            negated.append(remaining > 0)
+            if token in self.negation_cues:
+                remaining = _NEGATION_WINDOW
+            elif remaining:
+                remaining -= 1
+        return negated
+
+    def match(self, text: str) -> List[str]:
+        """Canonical codes mentioned (and not negated) in `text`, in order of first mention."""
+        codes = []
+        for _, _, code, negated in self.find(text):
+            if not negated and code not in codes:
+                codes.append(code)
+        return codes
+
+
+MATCHER = SymptomMatcher(DEFAULT_SYNONYMS)
+
+
+def match_codes(text: str) -> List[str]:
+    return MATCHER.match(text)
+
+
+__all__ = ["DEFAULT_SYNONYMS", "NEGATION_CUES", "SymptomMatcher", "MATCHER", "match_codes"]
+
+
+def _check() -> None:
+    cases = {
+        "no chest pain": [],
+        "denies any fever": [],
+        "no history of severe chest pain": [],
+        "no fever or cough": [],
+        "does not have chest pain": [],
+        "denies fever but has SOB": ["dyspnea"],
+        "no appetite and chest pain": ["chest_pain"],
+        "not sleeping well with severe headache": ["severe_headache"],
+        "no fever, cough for three days": ["cough"],
+        "without vomiting for a few days now fever": ["fever"],
+    }
+    for text, expected in cases.items():
+        got = match_codes(text)
+        assert got == expected, f"{text!r}: expected {expected}, got {got}"
+    print(f"{len(cases)} negation checks passed")
+
+
+if __name__ == "__main__":
+    _check()
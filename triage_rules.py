@@ -0,0 +1,376 @@
+"""Declarative triage rules and their compiled evaluators.
+
+Every threshold and weight used by the intake, risk scoring, severity and
+priority agents lives in one rule table (`DEFAULT_RULES`, or a JSON file
+named by TRIAGE_RULES_PATH with the same shape). `compile_rules(table)`
+turns it into a `CompiledRules` with two evaluators:
+
+- `evaluate(intake)`: one pass over a single case, returning flags, risk
+  score and factors, tier, severity band, drivers and priority
+- `evaluate_batch(...)`: the same rules as NumPy column operations, used by
+  `batch_triage`
+
+Symptom rules refer to canonical symptom codes (see `symptom_matcher`).
+
+`active()` returns the current rules. When TRIAGE_RULES_PATH is set the file
+is re-read after it changes (checked at most every TRIAGE_RULES_CHECK_SECONDS);
+`reload()` forces it. A table that fails to compile is rejected and the
+previous rules stay active.
+
+Run `python triage_rules.py` to time both evaluators.
+"""
+import json
+import operator
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import startup
+from symptom_matcher import match_codes
+
+# NumPy is only needed by the columnar evaluator; it is imported on first use
+_HAS_NUMPY = startup.available("numpy")
+_numpy = startup.lazy("numpy")
+if TYPE_CHECKING:
+    import numpy as np  # annotations only; imported lazily at run time
+
+DEFAULT_RULES = {
+    "version": "2",
+    # Intake flags, in the order they are reported; "symptom" is a canonical symptom code
+    "flags": [
+        {"name": "low_spo2", "vital": "spo2", "op": "<", "value": 92},
+        {"name": "low_bp", "vital": "systolicBP", "op": "<", "value": 90},
+        {"name": "tachycardia", "vital": "heartRate", "op": ">", "value": 120},
+        {"name": "high_fever", "vital": "temperatureC", "op": ">=", "value": 39.0},
+        {"name": "chest_pain", "symptom": "chest_pain"},
+        {"name": "dyspnea", "symptom": "dyspnea"},
+        {"name": "severe_headache", "symptom": "severe_headache"},
+    ],
+    # Risk points from the first matching band (highest first)
+    "bands": {
+        "age": [
+            {"min": 75, "points": 3, "label": "Age >= 75"},
+            {"min": 60, "points": 2, "label": "Age 60-74"},
+            {"min": 40, "points": 1, "label": "Age 40-59"},
+        ],
+        "durationHours": [
+            {"min": 72, "points": 2, "label": "Duration >= 72h"},
+            {"min": 24, "points": 1, "label": "Duration 24-72h"},
+        ],
+    },
+    # Risk points for abnormal vitals; counted in addition to the flag weights
+    "vitalPoints": [
+        {"flag": "low_spo2", "points": 4, "label": "Low SpO2 {value}%"},
+        {"flag": "low_bp", "points": 3, "label": "Low SBP {value} mmHg"},
+        {"flag": "tachycardia", "points": 2, "label": "Tachycardia {value} bpm"},
+        {"flag": "high_fever", "points": 1, "label": "High fever {value}°C"},
+    ],
+    "flagWeights": {
+        "chest_pain": 4, "dyspnea": 3, "severe_headache": 2,
+        "low_spo2": 4, "low_bp": 3, "tachycardia": 2, "high_fever": 1,
+    },
+    # [minimum risk, label], highest first; below all of them the default applies
+    "riskTiers": [[9, "high"], [5, "moderate"]],
+    "riskTierDefault": "low",
+    "severityBands": [[9, "critical"], [6, "severe"], [3, "moderate"]],
+    "severityDefault": "mild",
+    # Severity drivers, in report order: a flag (with its vital value) or symptom codes
+    "severityDrivers": [
+        {"flag": "low_spo2", "label": "Low oxygen saturation ({value}%)"},
+        {"symptoms": ["chest_pain"], "label": "Reported chest pain"},
+        {"symptoms": ["dyspnea"], "label": "Breathing difficulty"},
+        {"flag": "low_bp", "label": "Low blood pressure ({value} mmHg)"},
+        {"flag": "tachycardia", "label": "Rapid heart rate ({value} bpm)"},
+    ],
+    "priority": {
+        "bySeverity": {"critical": "P1", "severe": "P2"},
+        "default": "P3",
+        # A default-priority case carrying any of these flags is escalated
+        "escalateFlags": ["chest_pain", "low_spo2", "low_bp"],
+        "escalateTo": "P2",
+    },
+    "priorityNames": {"P1": "EMERGENCY", "P2": "URGENT", "P3": "Non-Urgent"},
+    "guidance": {
+        "P1": "Immediate emergency response advised. Call emergency services now.",
+        "P2": "Prompt clinical evaluation recommended. Seek medical care urgently.",
+        "P3": "Non-urgent; monitor symptoms and seek routine care if symptoms persist or worsen.",
+    },
+}
+
+_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+VITAL_FIELDS = ["heartRate", "systolicBP", "diastolicBP", "spo2", "temperatureC"]
+
+
+class RuleResult:
+    """Outcome of evaluating the rules for one case.
+
+    `compiled` is the `CompiledRules` that produced it, so later agents read
+    names and guidance from the same rule version even across a reload.
+    """
+
+    __slots__ = ("flags", "risk", "risk_factors", "tier", "severity", "drivers", "priority", "compiled")
+
+    def __init__(self, flags, risk, risk_factors, tier, severity, drivers, priority, compiled=None):
+        self.flags = flags
+        self.risk = risk
+        self.risk_factors = risk_factors
+        self.tier = tier
+        self.severity = severity
+        self.drivers = drivers
+        self.priority = priority
+        self.compiled = compiled
+
+
+def _pick(thresholds: Sequence, value, default):
+    for minimum, label in thresholds:
+        if value >= minimum:
+            return label
+    return default
+
+
+class CompiledRules:
+    """A rule table flattened into tuples, ready for repeated evaluation."""
+
+    def __init__(self, table: Dict):
+        self.table = table
+        self.version = str(table.get("version", ""))
+        self.flag_order = [f["name"] for f in table["flags"]]
+        self.vital_flags = [(f["name"], f["vital"], _OPS[f["op"]], f["op"], float(f["value"]))
+                            for f in table["flags"] if "vital" in f]
+        self.symptom_flags = [(f["name"], f["symptom"]) for f in table["flags"] if "symptom" in f]
+        vital_of = {name: vital for name, vital, _, _, _ in self.vital_flags}
+        self.bands = [(field, [(float(b["min"]), int(b["points"]), f"{b['label']} (+{b['points']})") for b in bands])
+                      for field, bands in table["bands"].items()]
+        self.vital_points = [(p["flag"], vital_of[p["flag"]], int(p["points"]), f"{p['label']} (+{p['points']})")
+                             for p in table["vitalPoints"]]
+        self.flag_weights = [(name, int(w), f"Flag '{name}' (+{w})") for name, w in table["flagWeights"].items() if w > 0]
+        self._weight_of = {name: (w, label) for name, w, label in self.flag_weights}
+        self.risk_tiers = [(float(m), label) for m, label in table["riskTiers"]]
+        self.risk_tier_default = table["riskTierDefault"]
+        self.severity_bands = [(float(m), label) for m, label in table["severityBands"]]
+        self.severity_default = table["severityDefault"]
+        self.drivers = [(d.get("flag"), vital_of.get(d.get("flag")), frozenset(d.get("symptoms", [])), d["label"])
+                        for d in table["severityDrivers"]]
+        prio = table["priority"]
+        self.priority_by_severity = dict(prio["bySeverity"])
+        self.priority_default = prio["default"]
+        self.escalate_flags = frozenset(prio["escalateFlags"])
+        self.escalate_to = prio["escalateTo"]
+        self.priority_names = dict(table["priorityNames"])
+        self.guidance = dict(table["guidance"])
+        unknown = ({p[0] for p in self.vital_points} | {d[0] for d in self.drivers if d[0]} | self.escalate_flags) - set(self.flag_order)
+        if unknown:
+            raise ValueError(f"rules reference undefined flags: {sorted(unknown)}")
+        for label in list(self.priority_by_severity.values()) + [self.priority_default, self.escalate_to]:
+            if label not in self.priority_names or label not in self.guidance:
+                raise ValueError(f"priority {label!r} has no name or guidance")
+
+    # Single-case evaluation
+
+    def risk_tier(self, risk) -> str:
+        return _pick(self.risk_tiers, risk, self.risk_tier_default)
+
+    def severity_band(self, risk) -> str:
+        return _pick(self.severity_bands, risk, self.severity_default)
+
+    def priority_for(self, severity: str, flags) -> str:
+        priority = self.priority_by_severity.get(severity.lower(), self.priority_default)
+        if priority == self.priority_default and not self.escalate_flags.isdisjoint(flags):
+            priority = self.escalate_to
+        return priority
+
+    def evaluate(self, intake: Dict) -> RuleResult:
+        """Evaluate every rule for an intake object (age, durationHours, symptomCodes, vitals)."""
+        vitals = intake.get("vitals") or {}
+        codes = intake.get("symptomCodes")
+        if codes is None:
+            codes = match_codes(", ".join(intake.get("symptoms") or []))
+        symptom_set = set(codes)
+
+        raised = set()
+        for name, vital, op, _, threshold in self.vital_flags:
+            value = vitals.get(vital)
+            if value is not None and op(value, threshold):
+                raised.add(name)
+        for name, code in self.symptom_flags:
+            if code in symptom_set:
+                raised.add(name)
+        flags = [f for f in self.flag_order if f in raised]
+
+        risk = 0
+        factors = []
+        for field, bands in self.bands:
+            value = intake.get(field)
+            if value is None:
+                continue
+            for minimum, points, label in bands:
+                if value >= minimum:
+                    risk += points
+                    factors.append(label)
+                    break
+        for flag, vital, points, label in self.vital_points:
+            if flag in raised:
+                risk += points
+                factors.append(label.format(value=vitals.get(vital)))
+        for flag in flags:
+            weighted = self._weight_of.get(flag)
+            if weighted:
+                risk += weighted[0]
+                factors.append(weighted[1])
+
+        severity = self.severity_band(risk)
+        drivers = []
+        for flag, vital, codes, label in self.drivers:
+            if (flag and flag in raised) or not codes.isdisjoint(symptom_set):
+                drivers.append(label.format(value=vitals.get(vital)) if vital else label)
+        return RuleResult(flags, risk, factors, self.risk_tier(risk), severity, drivers,
+                          self.priority_for(severity, raised), self)
+
+    # Columnar evaluation
+
+    def evaluate_batch(self, vitals: Dict[str, "np.ndarray"], age: "np.ndarray", duration: "np.ndarray",
+                       symptom_sets: List[set]) -> Dict[str, "np.ndarray"]:
+        """Evaluate the rules over columns (NaN for missing values) and sets of symptom codes.
+
+        Returns arrays: `flags` (bitmask in `flag_order`), `risk`, `tier`,
+        `severity` and `priority`.
+        """
+        np = _numpy()
+        n = len(symptom_sets)
+        masks = {}
+        with np.errstate(invalid="ignore"):  # NaN compares False, like the None guards
+            for name, vital, op, _, threshold in self.vital_flags:
+                masks[name] = op(vitals[vital], threshold)
+            columns = {"age": age, "durationHours": duration}
+            risk = np.zeros(n, dtype=np.int64)
+            for field, bands in self.bands:
+                col = columns[field]
+                risk += np.select([col >= m for m, _, _ in bands], [p for _, p, _ in bands], default=0)
+        for name, code in self.symptom_flags:
+            masks[name] = np.fromiter((code in s for s in symptom_sets), dtype=bool, count=n)
+        for flag, _, points, _ in self.vital_points:
+            risk += points * masks[flag]
+        for flag, weight, _ in self.flag_weights:
+            if flag in masks:
+                risk += weight * masks[flag]
+
+        tier = np.select([risk >= m for m, _ in self.risk_tiers], [t for _, t in self.risk_tiers], default=self.risk_tier_default)
+        severity = np.select([risk >= m for m, _ in self.severity_bands], [s for _, s in self.severity_bands],
+                             default=self.severity_default)
+        escalate = np.zeros(n, dtype=bool)
+        for flag in self.escalate_flags:
+            escalate |= masks[flag]
+        by_severity = list(self.priority_by_severity.items())
+        priority = np.select([severity == s for s, _ in by_severity], [p for _, p in by_severity], default=self.priority_default)
+        priority = np.where(escalate & (priority == self.priority_default), self.escalate_to, priority)
+
+        bits = np.zeros(n, dtype=np.int64)
+        for j, name in enumerate(self.flag_order):
+            bits |= masks[name].astype(np.int64) << j
+        return {"flags": bits, "risk": risk, "tier": tier, "severity": severity, "priority": priority}
+
+
+def compile_rules(table: Dict) -> CompiledRules:
+    return CompiledRules(table)
+
+
+RULES_PATH = os.environ.get("TRIAGE_RULES_PATH") or None
+CHECK_INTERVAL = float(os.environ.get("TRIAGE_RULES_CHECK_SECONDS", "1"))
+
+_lock = threading.Lock()
+_active = compile_rules(DEFAULT_RULES)
+_loaded_mtime: Optional[float] = None
+_next_check = 0.0
+_reloads = 0
+_last_error: Optional[str] = None
+
+
+def _load_file(path: str) -> Optional[CompiledRules]:
+    global _loaded_mtime, _reloads, _last_error
+    try:
+        mtime = os.stat(path).st_mtime
+        if mtime == _loaded_mtime:
+            return None
+        _loaded_mtime = mtime  # a broken file is reported once, not on every check
+        with open(path, "r", encoding="utf-8") as f:
+            rules = compile_rules(json.load(f))
+    except Exception as e:
+        _last_error = str(e)
+        print(f"Warning: triage rules not reloaded from {path}: {e}")
+        return None
+    _reloads += 1
+    _last_error = None
+    return rules
+
+
+def reload(path: Optional[str] = None) -> CompiledRules:
+    """Re-read the rule file now (TRIAGE_RULES_PATH by default) and activate it if valid."""
+    global _active, _loaded_mtime
+    path = path or RULES_PATH
+    with _lock:
+        if path:
+            _loaded_mtime = None
+            rules = _load_file(path)
+            if rules is not None:
+                _active = rules
+        return _active
+
+
+def active() -> CompiledRules:
+    """The rules in force, re-reading TRIAGE_RULES_PATH if it changed."""
+    global _active, _next_check
+    if RULES_PATH and time.monotonic() >= _next_check:
+        with _lock:
+            if time.monotonic() >= _next_check:
+                _next_check = time.monotonic() + CHECK_INTERVAL
+                rules = _load_file(RULES_PATH)
+                if rules is not None:
+                    _active = rules
+    return _active
+
+
+def stats() -> dict:
+    return {"version": _active.version, "path": RULES_PATH, "reloads": _reloads, "lastError": _last_error}
+
+
+if RULES_PATH:
+    active()
+
+
+def benchmark(n_cases: int = 20000) -> Dict[str, float]:
+    """Per-case cost of the single-case and columnar evaluators on synthetic cases."""
+    import random
+    rng = random.Random(0)
+    symptoms = ["chest pain", "shortness of breath", "fever", "severe headache", "cough", "dizziness"]
+    intakes = [{
+        "age": float(rng.randint(1, 95)), "durationHours": float(rng.randint(0, 100)),
+        "symptomCodes": match_codes(", ".join(rng.sample(symptoms, 2))),
+        "vitals": {"heartRate": float(rng.randint(50, 150)), "systolicBP": float(rng.randint(70, 160)),
+                   "diastolicBP": None, "spo2": float(rng.randint(82, 100)), "temperatureC": 37.0},
+    } for _ in range(n_cases)]
+    rules = active()
+    t0 = time.perf_counter()
+    for intake in intakes:
+        rules.evaluate(intake)
+    scalar = (time.perf_counter() - t0) / n_cases
+    result = {"cases": n_cases, "scalarMicros": round(scalar * 1e6, 2)}
+    if _HAS_NUMPY:
+        np = _numpy()
+
+        def col(values):
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        t0 = time.perf_counter()
+        rules.evaluate_batch({f: col([i["vitals"][f] for i in intakes]) for f in VITAL_FIELDS},
+                             col([i["age"] for i in intakes]), col([i["durationHours"] for i in intakes]),
+                             [set(i["symptomCodes"]) for i in intakes])
+        result["batchMicros"] = round((time.perf_counter() - t0) / n_cases * 1e6, 2)
+    return result
+
+
+__all__ = ["DEFAULT_RULES", "VITAL_FIELDS", "RuleResult", "CompiledRules", "compile_rules", "active", "reload", "stats"]
+
+
+if __name__ == "__main__":
+    print(benchmark())
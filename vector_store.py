@@ -0,0 +1,124 @@
+"""Process-wide Chroma client and collection holder.
+
+The client and the case collection are created lazily on first use, shared
+by every caller in the process, and guarded by a lock so concurrent requests
+do not race to construct them. If an operation fails, the holder drops the
+connection and retries once on a fresh one. After a failed connect it waits
+RECONNECT_INTERVAL seconds before trying again. `stats()` reports how long
+initialization took. Forked worker processes start without a connection and
+open their own. chromadb itself is only imported by the first connect.
+"""
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import startup
+
+_HAS_CHROMA = startup.available("chromadb")
+
+COLLECTION_NAME = os.environ.get("CHROMA_COLLECTION", "cases")
+PERSIST_DIRECTORY = os.environ.get("CHROMA_PERSIST_DIR", "./chroma_db")
+RECONNECT_INTERVAL = float(os.environ.get("CHROMA_RECONNECT_SECONDS", "5"))
+
+_lock = threading.Lock()
+_client = None
+_collection = None
+_init_seconds: Optional[float] = None
+_connects = 0
+_last_error: Optional[str] = None
+_last_failure_at = 0.0
+
+
+def _connect_locked() -> None:
+    global _client, _collection, _init_seconds, _connects, _last_error, _last_failure_at
+    started = time.perf_counter()
+    try:
+        chromadb = startup.load("chromadb")
+        Settings = startup.load("chromadb.config").Settings
+        client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory=PERSIST_DIRECTORY))
+        # create or get collection
+        try:
+            collection = client.get_collection(COLLECTION_NAME)
+        except Exception:
+            collection = client.create_collection(COLLECTION_NAME)
+    except Exception as e:
+        _last_error = str(e)
+        _last_failure_at = time.monotonic()
+        return
+    _client, _collection = client, collection
+    _init_seconds = time.perf_counter() - started
+    _connects += 1
+    _last_error = None
+
+
+def get_collection():
+    """Return the shared collection, connecting on first use; None if unavailable."""
+    if _collection is not None:
+        return _collection
+    if not _HAS_CHROMA:
+        return None
+    with _lock:
+        if _collection is None and time.monotonic() - _last_failure_at >= RECONNECT_INTERVAL:
+            _connect_locked()
+        return _collection
+
+
+def available() -> bool:
+    return get_collection() is not None
+
+
+def reset() -> None:
+    """Drop the shared client so the next call reconnects."""
+    global _client, _collection
+    with _lock:
+        _client, _collection = None, None
+
+
+def with_collection(fn: Callable):
+    """Call fn(collection); on failure reconnect once and retry.
+
+    Raises RuntimeError when no collection is available, or re-raises the
+    error from the retry.
+    """
+    collection = get_collection()
+    if collection is None:
+        raise RuntimeError(f"Chroma collection unavailable: {_last_error or 'chromadb not installed'}")
+    try:
+        return fn(collection)
+    except Exception:
+        reset()
+        collection = get_collection()
+        if collection is None:
+            raise
+        return fn(collection)
+
+
+def _after_fork_in_child() -> None:
+    # A client inherited from the parent process is not safe to reuse
+    global _lock, _client, _collection
+    _lock = threading.Lock()
+    _client, _collection = None, None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def persist() -> None:
+    client = _client
+    if client is not None:
+        client.persist()
+
+
+def stats() -> dict:
+    return {
+        "available": _HAS_CHROMA,
+        "connected": _collection is not None,
+        "initSeconds": None if _init_seconds is None else round(_init_seconds, 4),
+        "connects": _connects,
+        "lastError": _last_error,
+    }
+
+
+__all__ = ["get_collection", "available", "reset", "with_collection", "persist", "stats"]